@@ -2,10 +2,14 @@
 
 import os
 import json
+import shutil
 import tempfile
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file, render_template
+import time
+from flask import Flask, request, jsonify, send_file, render_template, Response, stream_with_context
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import get_input_stream
+from werkzeug.exceptions import RequestEntityTooLarge, ClientDisconnected
 import pandas as pd
 import logging
 from datetime import datetime
@@ -15,7 +19,9 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import our own modules
-from data_cleaner import clean_csv
+from data_cleaner import clean_csv, clean_csv_stream, PatientIndex
+from result_cache import ResultCache, HashingReader, code_fingerprint, file_digest, read_json, write_json_atomic
+from workspace import create_job_workspace, get_job_workspace, touch_job_workspace, cleanup_job_workspaces
 
 # Configure logging
 logging.basicConfig(
@@ -30,22 +36,126 @@ app = Flask(__name__,
             template_folder='../templates')
 
 # Configuration
-app.config['UPLOAD_FOLDER'] = '../uploads'
-app.config['REPORTS_FOLDER'] = '../patient_reports'
+# All job data lives under one root, independent of the working directory
+app.config['WORKSPACE_ROOT'] = os.path.abspath(os.environ.get(
+    'WORKSPACE_ROOT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'workspace')
+))
+app.config['JOBS_FOLDER'] = os.path.join(app.config['WORKSPACE_ROOT'], 'jobs')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+app.config['STREAM_MAX_CONTENT_LENGTH'] = 4 * 1024 * 1024 * 1024  # 4GB max for streamed uploads
 app.config['ALLOWED_EXTENSIONS'] = {'csv'}
+app.config['COMPRESSED_EXTENSIONS'] = {'gz'}
+app.config['DROP_DUPLICATE_PATIENTS'] = True  # Skip exact duplicate rows so they are not rendered or emailed twice; near duplicates are only reported
+app.config['CACHE_FOLDER'] = os.path.join(app.config['WORKSPACE_ROOT'], 'cache')
+app.config['CACHE_MAX_AGE'] = 7 * 24 * 3600  # Evict cached results after a week
+app.config['JOB_MAX_AGE'] = 7 * 24 * 3600  # Delete job workspaces unused for a week
+
+# File names inside each job's workspace
+CLEANED_FILENAME = 'cleaned.csv'
+LOG_FILENAME = 'cleaning.log'
+REPORTS_DIRNAME = 'reports'
 
 # Ensure directories exist
-Path(app.config['UPLOAD_FOLDER']).mkdir(exist_ok=True, parents=True)
-Path(app.config['REPORTS_FOLDER']).mkdir(exist_ok=True)
-Path("../logs").mkdir(exist_ok=True)
-Path("../data").mkdir(exist_ok=True)
+Path(app.config['JOBS_FOLDER']).mkdir(exist_ok=True, parents=True)
+
+# Cache of processed uploads, invalidated when the pipeline code or settings change
+result_cache = ResultCache(
+    app.config['CACHE_FOLDER'],
+    max_age=app.config['CACHE_MAX_AGE'],
+    version=code_fingerprint(f"drop_duplicates={app.config['DROP_DUPLICATE_PATIENTS']}")
+)
 
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def allowed_stream_file(filename):
+    """Check if a streamed upload has an allowed extension, optionally gzip-compressed"""
+    parts = filename.lower().rsplit('.', 2)
+    if len(parts) > 2 and parts[2] in app.config['COMPRESSED_EXTENSIONS']:
+        return parts[1] in app.config['ALLOWED_EXTENSIONS']
+    return allowed_file(filename)
+
+def discard_job(job_dir):
+    """Delete the workspace of an upload that failed, since it is never cached or cleaned up"""
+    if job_dir:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+def upload_too_large_response():
+    """Build the 413 response for a streamed upload over the size limit"""
+    limit_mb = app.config['STREAM_MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({
+        'status': 'error',
+        'message': f'File too large. Streamed uploads are limited to {limit_mb} MB.'
+    }), 413
+
+def client_disconnected_response():
+    """Build the 400 response for a streamed upload that ended before its declared length"""
+    return jsonify({
+        'status': 'error',
+        'message': 'Upload incomplete. The client disconnected before sending the whole file.'
+    }), 400
+
+def cached_upload_response(entry, filename):
+    """Build the upload response for a file that was already processed"""
+    job_id = entry['job_id']
+    logger.info(f"Upload {filename} matches cached job {job_id}")
+    job_dir = get_job_workspace(app.config['JOBS_FOLDER'], job_id)
+    if job_dir:
+        touch_job_workspace(job_dir)
+    return jsonify({
+        'status': 'success',
+        'message': 'File was already uploaded and cleaned',
+        'original_file': filename,
+        'cleaned_file': CLEANED_FILENAME,
+        'log_file': LOG_FILENAME,
+        'job_id': job_id,
+        'cached': True
+    })
+
+def cached_reports(output_dir, batch_size):
+    """Return the report names from a job's manifest if it was rendered the same way"""
+    manifest = read_json(Path(output_dir) / 'reports_manifest.json')
+    if (manifest and manifest.get('version') == result_cache.version
+            and manifest.get('batch_size') == batch_size
+            and all((Path(output_dir) / name).exists() for name in manifest.get('reports', []))):
+        return manifest['reports']
+    return None
+
+def save_reports_manifest(output_dir, batch_size, report_filenames):
+    """Record a job's finished report set so it can be served again without rendering"""
+    if report_filenames:
+        write_json_atomic(Path(output_dir) / 'reports_manifest.json', {
+            'version': result_cache.version,
+            'batch_size': batch_size,
+            'reports': report_filenames
+        })
+
+def remove_stale_jobs():
+    """Delete job workspaces that have not been used for JOB_MAX_AGE"""
+    for job_id in cleanup_job_workspaces(app.config['JOBS_FOLDER'], app.config['JOB_MAX_AGE']):
+        logger.info(f"Removed unused job workspace {job_id}")
+
+def parse_batch_size(value):
+    """Parse an optional batch size, raising ValueError unless it is a positive integer"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, int) and not isinstance(value, bool):
+        batch_size = value
+    elif isinstance(value, str) and value.isdigit():
+        batch_size = int(value)
+    else:
+        raise ValueError(f'Invalid batch_size: {value!r}')
+    if batch_size < 1:
+        raise ValueError(f'batch_size must be a positive integer, got {batch_size}')
+    return batch_size
+
+def sse_event(event, payload):
+    """Format a Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
 @app.route('/')
 def home():
     """Render the home page"""
@@ -83,38 +193,44 @@ def upload_patients_csv():
         }), 400
     
     if file and allowed_file(file.filename):
+        job_dir = None
         try:
-            # Create necessary directories
-            os.makedirs('data', exist_ok=True)
-            os.makedirs('logs', exist_ok=True)
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+            # Give the job its own workspace so concurrent uploads never share files
+            job_id, job_dir = create_job_workspace(app.config['JOBS_FOLDER'])
             
             # Save the uploaded file
             filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            safe_filename = f"{timestamp}_{filename}"
-            upload_path = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], safe_filename))
+            upload_path = str(job_dir / f"upload_{filename}")
             file.save(upload_path)
             
             logger.info(f"Saved uploaded file to {upload_path}")
             
+            # Return the existing job if this exact file was processed before
+            digest = file_digest(upload_path)
+            entry = result_cache.get(digest)
+            if entry:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                return cached_upload_response(entry, filename)
+            
             # Set absolute paths for the processed files
-            data_dir = os.path.abspath('data')
-            log_dir = os.path.abspath('logs')
-            cleaned_path = os.path.join(data_dir, f"cleaned_{timestamp}.csv")
-            log_path = os.path.join(log_dir, f"cleaning_{timestamp}.log")
+            cleaned_path = str(job_dir / CLEANED_FILENAME)
+            log_path = str(job_dir / LOG_FILENAME)
             
             logger.info(f"Cleaning CSV from {upload_path} to {cleaned_path}")
             
             # Clean the CSV
+            index = PatientIndex()
             clean_success = clean_csv(
                 input_file=upload_path,
                 output_file=cleaned_path,
-                log_file=log_path
+                log_file=log_path,
+                drop_duplicates=app.config['DROP_DUPLICATE_PATIENTS'],
+                index=index
             )
             
             if not clean_success:
                 logger.error(f"Failed to clean CSV: {upload_path}")
+                discard_job(job_dir)
                 return jsonify({
                     'status': 'error',
                     'message': 'Failed to clean CSV data. See logs for details.'
@@ -122,17 +238,23 @@ def upload_patients_csv():
             
             logger.info(f"Successfully cleaned CSV to {cleaned_path}")
             
+            result_cache.put(digest, job_id, required=[cleaned_path])
+            remove_stale_jobs()
+            
             return jsonify({
                 'status': 'success',
                 'message': 'File uploaded and cleaned successfully',
                 'original_file': filename,
-                'cleaned_file': os.path.basename(cleaned_path),
-                'log_file': os.path.basename(log_path),
-                'job_id': timestamp
+                'cleaned_file': CLEANED_FILENAME,
+                'log_file': LOG_FILENAME,
+                'exact_duplicates': index.exact_count,
+                'near_duplicates': index.near_count,
+                'job_id': job_id
             })
             
         except Exception as e:
             logger.error(f"Error processing upload: {e}")
+            discard_job(job_dir)
             return jsonify({
                 'status': 'error',
                 'message': f'Error processing upload: {str(e)}'
@@ -143,6 +265,105 @@ def upload_patients_csv():
         'message': 'File type not allowed. Please upload a CSV file.'
     }), 400
 
+@app.route('/api/upload-stream', methods=['POST'])
+def upload_patients_csv_stream():
+    """Upload a patients.csv file as the raw request body and clean it while it arrives
+    
+    The file name is passed as the ``filename`` query parameter. Gzip-compressed
+    bodies (``Content-Encoding: gzip`` or a ``.csv.gz`` file name) are
+    decompressed on the fly, so the full upload is never buffered in memory.
+    """
+    filename = secure_filename(request.args.get('filename', 'patients.csv'))
+    if not allowed_stream_file(filename):
+        return jsonify({
+            'status': 'error',
+            'message': 'File type not allowed. Please upload a CSV or CSV.GZ file.'
+        }), 400
+    
+    compressed = None
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip' or filename.lower().endswith('.gz'):
+        compressed = True
+    
+    job_dir = None
+    try:
+        # Give the job its own workspace so concurrent uploads never share files
+        job_id, job_dir = create_job_workspace(app.config['JOBS_FOLDER'])
+        cleaned_path = str(job_dir / CLEANED_FILENAME)
+        log_path = str(job_dir / LOG_FILENAME)
+        
+        # Read the body directly, with a larger limit than buffered uploads,
+        # hashing it on the way so repeated uploads can be matched
+        stream = HashingReader(get_input_stream(
+            request.environ,
+            max_content_length=app.config['STREAM_MAX_CONTENT_LENGTH']
+        ))
+        
+        logger.info(f"Streaming upload {filename} to {cleaned_path}")
+        index = PatientIndex()
+        record_count = clean_csv_stream(
+            stream,
+            output_file=cleaned_path,
+            log_file=log_path,
+            compressed=compressed,
+            drop_duplicates=app.config['DROP_DUPLICATE_PATIENTS'],
+            index=index
+        )
+        
+        if record_count is None:
+            discard_job(job_dir)
+            # The cleaner logs read errors too, so check whether the body was over the limit
+            if isinstance(stream.error, RequestEntityTooLarge):
+                logger.error(f"Streamed upload too large: {filename}")
+                return upload_too_large_response()
+            if isinstance(stream.error, ClientDisconnected):
+                logger.error(f"Streamed upload interrupted: {filename}")
+                return client_disconnected_response()
+            logger.error(f"Failed to clean streamed CSV: {filename}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Failed to clean CSV data. See logs for details.'
+            }), 500
+        
+        # Reuse the existing job, and its reports, if this exact file was processed before
+        digest = stream.hexdigest()
+        entry = result_cache.get(digest)
+        if entry:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return cached_upload_response(entry, filename)
+        
+        logger.info(f"Successfully cleaned {record_count} records to {cleaned_path}")
+        
+        result_cache.put(digest, job_id, required=[cleaned_path])
+        remove_stale_jobs()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'File uploaded and cleaned successfully',
+            'original_file': filename,
+            'cleaned_file': CLEANED_FILENAME,
+            'log_file': LOG_FILENAME,
+            'records': record_count,
+            'exact_duplicates': index.exact_count,
+            'near_duplicates': index.near_count,
+            'job_id': job_id
+        })
+        
+    except RequestEntityTooLarge:
+        logger.error(f"Streamed upload too large: {filename}")
+        discard_job(job_dir)
+        return upload_too_large_response()
+    except ClientDisconnected:
+        logger.error(f"Streamed upload interrupted: {filename}")
+        discard_job(job_dir)
+        return client_disconnected_response()
+    except Exception as e:
+        logger.error(f"Error processing streamed upload: {e}")
+        discard_job(job_dir)
+        return jsonify({
+            'status': 'error',
+            'message': f'Error processing upload: {str(e)}'
+        }), 500
+
 @app.route('/api/generate-reports', methods=['POST'])
 def generate_patient_reports():
     """Generate patient reports from cleaned data"""
@@ -154,43 +375,62 @@ def generate_patient_reports():
         }), 400
     
     job_id = data['job_id']
-    cleaned_file = os.path.abspath(f"data/cleaned_{job_id}.csv")
+    job_dir = get_job_workspace(app.config['JOBS_FOLDER'], job_id)
+    cleaned_file = str(job_dir / CLEANED_FILENAME) if job_dir else None
     
-    logger.info(f"Looking for cleaned file at: {cleaned_file}")
-    if not Path(cleaned_file).exists():
-        # Try alternative path
-        cleaned_file = os.path.abspath(f"../data/cleaned_{job_id}.csv")
-        logger.info(f"Trying alternative path: {cleaned_file}")
-        
-        if not Path(cleaned_file).exists():
-            logger.error(f"Could not find cleaned file for job_id: {job_id}")
-            return jsonify({
-                'status': 'error',
-                'message': f'Could not find cleaned file for job_id: {job_id}'
-            }), 404
+    if not cleaned_file or not Path(cleaned_file).exists():
+        logger.error(f"Could not find cleaned file for job_id: {job_id}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Could not find cleaned file for job_id: {job_id}'
+        }), 404
     
-    # Create a job-specific output directory
-    output_dir = os.path.abspath(f"{app.config['REPORTS_FOLDER']}/{job_id}")
+    try:
+        batch_size = parse_batch_size(data.get('batch_size'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    # Create the job's report directory
+    output_dir = str(job_dir / REPORTS_DIRNAME)
     Path(output_dir).mkdir(exist_ok=True)
     
+    # Return the existing report set if this job was already rendered the same way
+    report_filenames = cached_reports(output_dir, batch_size)
+    if report_filenames:
+        logger.info(f"Returning {len(report_filenames)} cached reports for job {job_id}")
+        return jsonify({
+            'status': 'success',
+            'message': f"Generated {len(report_filenames)} reports",
+            'reports': report_filenames,
+            'job_id': job_id,
+            'cached': True
+        })
+    
     try:
         logger.info(f"Generating reports from {cleaned_file} to {output_dir}")
         # Generate reports
         from report_generator import main as generate_reports
-        generate_reports(
+        reports = generate_reports(
             generate_samples=False, 
             input_file=cleaned_file, 
-            output_folder=output_dir
+            output_folder=output_dir,
+            batch_size=batch_size
         )
+        if reports is None:
+            raise RuntimeError('report generation failed, see server logs')
         
-        # Get list of generated reports
-        reports = list(Path(output_dir).glob("*.pdf"))
-        report_filenames = [report.name for report in reports]
+        # Only list this run's files; other batch sizes may share the directory
+        report_filenames = sorted(report.name for report in reports)
         
-        logger.info(f"Generated {len(reports)} reports: {report_filenames}")
+        save_reports_manifest(output_dir, batch_size, report_filenames)
+        
+        logger.info(f"Generated {len(report_filenames)} reports: {report_filenames}")
         return jsonify({
             'status': 'success',
-            'message': f'Generated {len(reports)} reports',
+            'message': f'Generated {len(report_filenames)} reports',
             'reports': report_filenames,
             'job_id': job_id
         })
@@ -202,17 +442,99 @@ def generate_patient_reports():
             'message': f'Error generating reports: {str(e)}'
         }), 500
 
+@app.route('/api/generate-reports/stream/<job_id>')
+def stream_patient_reports(job_id):
+    """Generate patient reports, streaming progress as Server-Sent Events
+    
+    Emits a ``start`` event with the patient count, a ``progress`` event per
+    patient (rows done, ETA and the latest finished report file), then
+    ``complete`` with the full report list, or ``error``. Reports can be
+    downloaded as soon as they appear in a progress event.
+    """
+    job_dir = get_job_workspace(app.config['JOBS_FOLDER'], job_id)
+    cleaned_file = str(job_dir / CLEANED_FILENAME) if job_dir else None
+    
+    if not cleaned_file or not Path(cleaned_file).exists():
+        logger.error(f"Could not find cleaned file for job_id: {job_id}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Could not find cleaned file for job_id: {job_id}'
+        }), 404
+    
+    try:
+        batch_size = parse_batch_size(request.args.get('batch_size'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    output_dir = str(job_dir / REPORTS_DIRNAME)
+    Path(output_dir).mkdir(exist_ok=True)
+    
+    def events():
+        report_filenames = cached_reports(output_dir, batch_size)
+        if report_filenames:
+            logger.info(f"Returning {len(report_filenames)} cached reports for job {job_id}")
+            yield sse_event('complete', {'job_id': job_id, 'reports': report_filenames, 'cached': True})
+            return
+        
+        try:
+            from report_generator import iter_patient_reports, iter_batch_reports, iter_patient_records, count_patient_records
+            total = count_patient_records(cleaned_file)
+            yield sse_event('start', {'job_id': job_id, 'total': total})
+            
+            logger.info(f"Streaming report generation from {cleaned_file} to {output_dir}")
+            patients = iter_patient_records(cleaned_file)
+            if batch_size:
+                reports = iter_batch_reports(patients, output_dir, batch_size)
+            else:
+                reports = iter_patient_reports(patients, output_dir)
+            
+            started = time.monotonic()
+            produced = []
+            for done, report_path in enumerate(reports, 1):
+                if report_path:
+                    produced.append(report_path.name)
+                elapsed = time.monotonic() - started
+                yield sse_event('progress', {
+                    'done': done,
+                    'total': total,
+                    'eta_seconds': round(elapsed / done * (total - done), 1),
+                    'report': report_path.name if report_path else None
+                })
+            
+            # Only list this run's files; other batch sizes may share the directory
+            report_filenames = sorted(produced)
+            save_reports_manifest(output_dir, batch_size, report_filenames)
+            
+            logger.info(f"Generated {len(report_filenames)} reports for job {job_id}")
+            yield sse_event('complete', {'job_id': job_id, 'reports': report_filenames})
+            
+        except Exception as e:
+            logger.error(f"Error generating reports: {e}")
+            yield sse_event('error', {'message': f'Error generating reports: {str(e)}'})
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        # Stop proxies from buffering the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/download-report/<job_id>/<filename>')
 def download_report(job_id, filename):
     """Download a specific patient report"""
-    report_path = Path(f"{app.config['REPORTS_FOLDER']}/{job_id}/{secure_filename(filename)}")
+    job_dir = get_job_workspace(app.config['JOBS_FOLDER'], job_id)
+    report_path = job_dir / REPORTS_DIRNAME / secure_filename(filename) if job_dir else None
     
-    if not report_path.exists():
+    if not report_path or not report_path.exists():
         return jsonify({
             'status': 'error',
             'message': f'Report file not found: {filename}'
         }), 404
     
+    touch_job_workspace(job_dir)
     try:
         return send_file(
             report_path,
@@ -229,14 +551,16 @@ def download_report(job_id, filename):
 @app.route('/api/download-cleaned-data/<job_id>')
 def download_cleaned_data(job_id):
     """Download the cleaned patient data"""
-    cleaned_file = Path(f"../data/cleaned_{job_id}.csv")
+    job_dir = get_job_workspace(app.config['JOBS_FOLDER'], job_id)
+    cleaned_file = job_dir / CLEANED_FILENAME if job_dir else None
     
-    if not cleaned_file.exists():
+    if not cleaned_file or not cleaned_file.exists():
         return jsonify({
             'status': 'error',
             'message': f'Cleaned data file not found for job_id: {job_id}'
         }), 404
     
+    touch_job_workspace(job_dir)
     try:
         return send_file(
             cleaned_file,
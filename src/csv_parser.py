@@ -0,0 +1,51 @@
+import csv
+import io
+import gzip
+
+# Gzip streams start with these two magic bytes
+GZIP_MAGIC = b'\x1f\x8b'
+
+def open_text_stream(stream, compressed=None, encoding='utf-8-sig'):
+    """Wrap a binary stream for incremental CSV reading, decompressing gzip on the fly
+
+    When compressed is None, gzip is detected from the magic bytes at the start of the stream.
+    Decoding is strict, so a file in another encoding raises UnicodeDecodeError
+    instead of silently corrupting patient names.
+    """
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    if compressed is None:
+        compressed = stream.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    # newline='' lets the csv module handle line endings inside quoted fields
+    return io.TextIOWrapper(stream, encoding=encoding, errors='strict', newline='')
+
+def fit_row(row, width):
+    """Pad short rows and merge extra fields into the last field"""
+    if len(row) < width:
+        row.extend([''] * (width - len(row)))
+    elif len(row) > width:
+        # Combine extra fields into the last field
+        row = row[:width-1] + [' '.join(row[width-1:])]
+    return row
+
+def parse_csv(text_file):
+    """Parse an open CSV text file with a single reader
+
+    Returns the stripped header names and a generator of rows fitted to the
+    header width. Quoted fields may span several lines. Blank lines are skipped.
+    """
+    reader = csv.reader(text_file)
+    header_row = next(reader, None)
+    if not header_row:
+        raise ValueError("No header row found")
+    headers = [h.strip() for h in header_row]
+    width = len(headers)
+
+    def rows():
+        for row in reader:
+            if row:
+                yield fit_row(row, width)
+
+    return headers, rows()
@@ -1,10 +1,21 @@
 import pandas as pd
-import csv
+import os
+import sys
 from pathlib import Path
 import re
 import argparse
 from datetime import datetime
 
+# Add the current directory to the path to ensure imports work correctly
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from csv_parser import open_text_stream, parse_csv, fit_row
+from workspace import atomic_path
+from pipeline_journal import PipelineJournal, input_signature, DEFAULT_JOURNAL
+
+# Input rows between cleaning checkpoints when running with a journal
+CHECKPOINT_ROWS = 1000
+
 def clean_phone(phone):
     """Clean and standardize phone numbers"""
     if pd.isnull(phone):
@@ -21,64 +32,277 @@ def clean_name(name):
     # Capitalize each word
     return ' '.join(word.capitalize() for word in str(name).lower().split())
 
-def clean_csv(input_file='data/patients.csv', output_file='data/cleaned_patients.csv', log_file='logs/data_cleaning_log.txt'):
+def quote_field(field):
+    """Quote a CSV field containing separators, newlines or quotes, doubling embedded quotes"""
+    if field and (',' in field or '\n' in field or '"' in field):
+        return '"' + field.replace('"', '""') + '"'
+    return field
+
+def clean_row(row, headers):
+    """Clean a single parsed CSV row and return it as an output line"""
+    # Ensure we have the right number of fields
+    row = fit_row(row, len(headers))
     
-    # Ensure log directory exists
-    Path('logs').mkdir(exist_ok=True)
+    # Clean specific fields
+    row_dict = dict(zip(headers, row))
+    
+    # Clean full name
+    if 'full_name' in row_dict:
+        row_dict['full_name'] = clean_name(row_dict['full_name'])
+    
+    # Clean phone
+    if 'phone' in row_dict:
+        row_dict['phone'] = clean_phone(row_dict['phone'])
+    
+    # Reconstruct the row in the correct order
+    cleaned_row = [str(row_dict.get(h, '')).strip() for h in headers]
+    
+    # Quote fields containing separators, newlines or quotes, doubling embedded
+    # quotes; the phone is left alone as clean_phone already quotes it
+    quoted_row = [
+        quote_field(field) if h != 'phone' else field
+        for h, field in zip(headers, cleaned_row)
+    ]
+    
+    return ','.join(quoted_row)
+
+# Byte tables for normalize_identity, which runs on every row; translate is
+# several times faster than the equivalent regular expressions
+_NAME_LETTERS = bytes(c if ord('a') <= c <= ord('z') else ord(' ') for c in range(256))
+_NON_DIGITS = bytes(c for c in range(256) if not ord('0') <= c <= ord('9'))
+
+def normalize_identity(name, phone, age, date_of_birth='', patient_id=''):
+    """Build a patient identity key that ignores case, punctuation and name order
+    
+    A name alone is not enough to call two rows the same patient, so the key
+    also needs a phone number, or failing that a date of birth or patient ID.
+    Returns None when there is nothing to anchor the identity to.
+    """
+    name_tokens = sorted(str(name).lower().encode('ascii', 'replace').translate(_NAME_LETTERS).split())
+    # Keep the last 10 digits so a leading country code does not matter
+    phone_digits = str(phone).encode('ascii', 'replace').translate(None, _NON_DIGITS)[-10:].decode()
+    # Drop a float suffix such as 43.0
+    age_digits = str(age).strip()
+    whole, point, fraction = age_digits.rpartition('.')
+    if point and not fraction.strip('0'):
+        age_digits = whole
+    if phone_digits:
+        anchor = f"phone:{phone_digits}"
+    elif str(date_of_birth).strip():
+        anchor = f"dob:{str(date_of_birth).strip()}"
+    elif str(patient_id).strip():
+        anchor = f"id:{str(patient_id).strip().upper()}"
+    else:
+        return None
+    if not name_tokens:
+        return None
+    return f"{b' '.join(name_tokens).decode()}|{anchor}|{age_digits}"
+
+class PatientIndex:
+    """Hash-based index of patient identities for spotting duplicates in one pass
+    
+    Only a 64-bit hash of each unique identity and of its first cleaned row is
+    kept, so memory grows with the number of unique patients, not the number
+    of rows.
+    A row is an exact duplicate when its cleaned contents match the first row
+    with the same identity, and a near duplicate when only the identity matches.
+    Near duplicates may be different visits or data entry errors, so they are
+    reported but never dropped.
+    """
+    
+    def __init__(self):
+        self.columns = [None] * 5
+        self.seen = {}
+        self.exact_count = 0
+        self.near_count = 0
+    
+    def set_headers(self, headers):
+        """Locate the name, phone, age, birth date and ID columns used for the identity key"""
+        name_column = 'full_name' if 'full_name' in headers else 'name'
+        columns = (name_column, 'phone', 'age', 'date_of_birth', 'patient_id')
+        self.columns = [headers.index(h) if h in headers else None for h in columns]
+    
+    def add(self, row, cleaned_line, line_number):
+        """Record a row and return ('exact' or 'near', first line number) if it is a duplicate"""
+        key = normalize_identity(*[row[i] if i is not None and i < len(row) else '' for i in self.columns])
+        if key is None:
+            return None
+        
+        key = hash(key)
+        row_digest = hash(cleaned_line)
+        if key not in self.seen:
+            self.seen[key] = (line_number, row_digest)
+            return None
+        
+        first_line, first_digest = self.seen[key]
+        if row_digest == first_digest:
+            self.exact_count += 1
+            return 'exact', first_line
+        self.near_count += 1
+        return 'near', first_line
+
+def log_duplicate(log, duplicate, line_number):
+    """Write a duplicate match to the cleaning log"""
+    kind, first_line = duplicate
+    log.write(f"Line {line_number} is a duplicate of line {first_line} ({kind} match)\n")
+
+def iter_cleaned_lines(rows, headers, index, log, drop_duplicates=False, skip_rows=0):
+    """Clean parsed rows, yielding (line number, output line) for each row to write
+    
+    Duplicates are logged and recorded in index, and exact duplicates are left
+    out when drop_duplicates is set. A row that fails to clean is logged and
+    yielded as an empty row to maintain the line count. The first skip_rows
+    rows are only added to the index, so a resumed run still spots duplicates
+    of them.
+    """
+    empty_line = ','.join([''] * len(headers))
+    for i, row in enumerate(rows, 1):
+        if i <= skip_rows:
+            try:
+                index.add(row, clean_row(row, headers), i)
+            except Exception:
+                pass
+            continue
+        
+        try:
+            cleaned_line = clean_row(row, headers)
+            duplicate = index.add(row, cleaned_line, i)
+            if duplicate:
+                log_duplicate(log, duplicate, i)
+                if drop_duplicates and duplicate[0] == 'exact':
+                    continue
+            log.write(f"Processed line {i} successfully\n")
+        except Exception as e:
+            log.write(f"Error processing line {i}: {e}\n")
+            cleaned_line = empty_line
+        yield i, cleaned_line
+
+def clean_csv_stream(stream, output_file, log_file='logs/data_cleaning_log.txt', compressed=None, drop_duplicates=False, index=None):
+    """Clean CSV data incrementally while it is read from a binary stream
+    
+    Rows are parsed, cleaned and written one at a time so memory use does not
+    depend on the size of the input. Duplicate patients are logged, and exact
+    duplicates are skipped when drop_duplicates is set; pass a PatientIndex as
+    index to inspect the counts afterwards. Returns the number of records
+    written, or None if the data could not be processed.
+    """
+    Path(log_file).parent.mkdir(parents=True, exist_ok=True)
     
     with open(log_file, 'w') as log:
         try:
-            # Read the raw CSV data as text first
-            with open(input_file, 'r') as f:
-                lines = f.readlines()
-            
             # Process header
-            headers = [h.strip() for h in lines[0].strip().split(',')]
-            cleaned_lines = [','.join(headers)]
+            headers, rows = parse_csv(open_text_stream(stream, compressed=compressed))
+            if index is None:
+                index = PatientIndex()
+            index.set_headers(headers)
             
-            # Process each data line
-            for i, line in enumerate(lines[1:], 1):
-                try:
-                    # Split the line, respecting quoted values
-                    row = list(csv.reader([line.strip()]))[0]
-                    
-                    # Ensure we have the right number of fields
-                    while len(row) < len(headers):
-                        row.append('')
-                    if len(row) > len(headers):
-                        # Combine extra fields into the last field
-                        row = row[:len(headers)-1] + [' '.join(row[len(headers)-1:])]
-                    
-                    # Clean specific fields
-                    row_dict = dict(zip(headers, row))
-                    
-                    # Clean full name
-                    if 'full_name' in row_dict:
-                        row_dict['full_name'] = clean_name(row_dict['full_name'])
-                    
-                    # Clean phone
-                    if 'phone' in row_dict:
-                        row_dict['phone'] = clean_phone(row_dict['phone'])
-                    
-                    # Reconstruct the row in the correct order
-                    cleaned_row = [str(row_dict.get(h, '')).strip() for h in headers]
-                    
-                    # Quote all fields
-                    quoted_row = [f'"{field}"' if field and ',' in field else field for field in cleaned_row]
-                    
-                    cleaned_lines.append(','.join(quoted_row))
-                    log.write(f"Processed line {i} successfully\n")
-                    
-                except Exception as e:
-                    log.write(f"Error processing line {i}: {e}\n")
-                    # Add empty row to maintain line count
-                    cleaned_lines.append(','.join([''] * len(headers)))
+            record_count = 0
+            # Write to a temp file so readers never see a partially cleaned file
+            with atomic_path(output_file) as temp_output, open(temp_output, 'w') as out:
+                out.write(','.join(headers))
+                
+                for _, cleaned_line in iter_cleaned_lines(rows, headers, index, log, drop_duplicates):
+                    out.write('\n' + cleaned_line)
+                    record_count += 1
+            
+            log.write(f"\nCleaned data saved to {output_file}\n")
+            log.write(f"Found {index.exact_count} exact and {index.near_count} near duplicate records.\n")
+            log.write(f"Found {record_count} patient records.\n")
+            
+        except Exception as e:
+            log.write(f"\nError: {e}\n")
+            return None
+    
+    return record_count
+
+def clean_csv_resumable(input_file, output_file, log_file, journal, resume=True, drop_duplicates=False, checkpoint_rows=CHECKPOINT_ROWS):
+    """Clean a CSV file while recording checkpoints in a PipelineJournal
+    
+    Cleaned rows are appended to output_file.partial. Every checkpoint_rows
+    input rows the journal records how many rows were read and how long the
+    partial output is. On resume the partial output is truncated to the last
+    checkpoint and cleaning carries on from there; rows before it are only
+    fed through the duplicate index so duplicates are still found across the
+    restart. Returns the number of records written, or None on error.
+    """
+    Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+    partial_file = Path(f"{output_file}.partial")
+    try:
+        resumed = journal.begin_step('clean', input_signature(input_file, drop_duplicates=drop_duplicates), resume)
+    except OSError as e:
+        with open(log_file, 'w') as log:
+            log.write(f"\nError: {e}\n")
+        return None
+
+    record_count = journal.get_checkpoint('clean', 'done')
+    if resumed and record_count is not None and Path(output_file).exists():
+        print(f"Cleaning already finished, {record_count} records in {output_file}")
+        return record_count
+
+    checkpoint = journal.get_checkpoint('clean', 'progress') if resumed and partial_file.exists() else None
+    skip_rows, record_count = (checkpoint['rows'], checkpoint['records']) if checkpoint else (0, 0)
+    if checkpoint:
+        # Drop anything written after the last checkpoint
+        os.truncate(partial_file, checkpoint['offset'])
+
+    with open(log_file, 'a' if checkpoint else 'w') as log:
+        try:
+            with open(input_file, 'rb') as f, open(partial_file, 'a' if checkpoint else 'w') as out:
+                headers, rows = parse_csv(open_text_stream(f))
+                index = PatientIndex()
+                index.set_headers(headers)
+
+                if checkpoint:
+                    log.write(f"\nResuming after line {skip_rows}\n")
+                else:
+                    out.write(','.join(headers))
+
+                for i, cleaned_line in iter_cleaned_lines(rows, headers, index, log, drop_duplicates, skip_rows):
+                    out.write('\n' + cleaned_line)
+                    record_count += 1
+
+                    if i % checkpoint_rows == 0:
+                        # Flush first so the recorded offset never points past the data
+                        out.flush()
+                        journal.set_checkpoint('clean', 'progress', {'rows': i, 'offset': out.tell(), 'records': record_count})
+
+            os.replace(partial_file, output_file)
+            journal.set_checkpoint('clean', 'done', record_count, durable=True)
+
+            log.write(f"\nCleaned data saved to {output_file}\n")
+            log.write(f"Found {index.exact_count} exact and {index.near_count} near duplicate records.\n")
+            log.write(f"Found {record_count} patient records.\n")
+
+        except Exception as e:
+            log.write(f"\nError: {e}\n")
+            return None
+
+    return record_count
+
+def clean_csv(input_file='data/patients.csv', output_file='data/cleaned_patients.csv', log_file='logs/data_cleaning_log.txt', drop_duplicates=False, index=None):
+
+    # Ensure log directory exists
+    Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+    
+    with open(log_file, 'w') as log:
+        try:
+            # Parse the file with a single reader so quoted newlines are kept intact
+            with open(input_file, 'rb') as f:
+                headers, rows = parse_csv(open_text_stream(f))
+                if index is None:
+                    index = PatientIndex()
+                index.set_headers(headers)
+                cleaned_lines = [','.join(headers)]
+                
+                # Process each data line
+                cleaned_lines.extend(line for _, line in iter_cleaned_lines(rows, headers, index, log, drop_duplicates))
             
             # Write the cleaned data
-            with open(output_file, 'w') as f:
+            with atomic_path(output_file) as temp_output, open(temp_output, 'w') as f:
                 f.write('\n'.join(cleaned_lines))
             
             log.write(f"\nCleaned data saved to {output_file}\n")
+            log.write(f"Found {index.exact_count} exact and {index.near_count} near duplicate records.\n")
             
             # Verify the cleaned file
             df = pd.read_csv(output_file)
@@ -96,9 +320,21 @@ if __name__ == '__main__':
     parser.add_argument('-i', '--input', default='data/patients.csv', help='Input CSV file path')
     parser.add_argument('-o', '--output', default='data/cleaned_patients.csv', help='Output CSV file path')
     parser.add_argument('-l', '--log', default='logs/data_cleaning_log.txt', help='Log file path')
+    parser.add_argument('--drop-duplicates', action='store_true', help='Remove exact duplicate patients instead of only logging them')
+    parser.add_argument('--journal', nargs='?', const=DEFAULT_JOURNAL, help='Record checkpoints in this journal so the run can be resumed')
+    parser.add_argument('--resume', action='store_true', help='Continue from the checkpoints in the journal')
     args = parser.parse_args()
     
-    if clean_csv(args.input, args.output, args.log):
+    if args.resume and not args.journal:
+        args.journal = DEFAULT_JOURNAL
+    
+    if args.journal:
+        with PipelineJournal(args.journal) as journal:
+            success = clean_csv_resumable(args.input, args.output, args.log, journal, resume=args.resume, drop_duplicates=args.drop_duplicates) is not None
+    else:
+        success = clean_csv(args.input, args.output, args.log, drop_duplicates=args.drop_duplicates)
+    
+    if success:
         print(f"Data cleaning completed successfully. Check {args.log} for details.")
     else:
         print(f"Error during data cleaning. Check {args.log} for details.")
@@ -1,8 +1,20 @@
 import yagmail
 import pandas as pd
+import os
+import sys
+import time
 from pathlib import Path
-import csv
 import argparse
+from email.utils import make_msgid
+
+# Add the current directory to the path to ensure imports work correctly
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from csv_parser import open_text_stream, parse_csv
+from report_optimizer import optimize_pdf, DEFAULT_TARGET_BYTES
+from pipeline_journal import PipelineJournal, DEFAULT_JOURNAL
+from result_cache import file_digest
+from report_generator import report_filename
 
 def generate_email(name):
     """Generate a simple email from the name (for demo purposes only)"""
@@ -16,35 +28,25 @@ def clean_name(name):
 
 def read_csv_manually(file_path):
     """Read CSV file manually to handle problematic formatting"""
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
-    
-    # Get headers
-    headers = [h.strip() for h in lines[0].strip().split(',')]
-    data = []
-    
-    # Process each line
-    for line in lines[1:]:
-        # Use csv module to handle quoted fields properly
-        row = list(csv.reader([line.strip()]))[0]
-        
-        # Ensure correct number of fields
-        while len(row) < len(headers):
-            row.append('')
-        if len(row) > len(headers):
-            # Combine extra fields into the last field
-            row = row[:len(headers)-1] + [' '.join(row[len(headers)-1:])]
-        
-        data.append(dict(zip(headers, row)))
-    
-    return pd.DataFrame(data)
+    with open(file_path, 'rb') as f:
+        # One reader over the whole file, with short rows padded and extra fields merged
+        headers, rows = parse_csv(open_text_stream(f))
+        return pd.DataFrame(list(rows), columns=headers)
+
+def format_bytes(size):
+    """Format a byte count for the summary"""
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
 
-def send_reports(csv_path='data/patients.csv', report_folder='patient_reports', sender_email="your_email@gmail.com", sender_password="your_app_password", demo_mode=True):
+def send_reports(csv_path='data/patients.csv', report_folder='patient_reports', sender_email="your_email@gmail.com", sender_password="your_app_password", demo_mode=True, optimize=True, target_bytes=DEFAULT_TARGET_BYTES, journal_path=None, resume=False):
 
     try:
         # Try different methods to read the CSV
         try:
-            df = pd.read_csv(csv_path)
+            df = pd.read_csv(csv_path, dtype={'patient_id': str})
         except Exception as e:
             print(f"Standard CSV reading failed, trying manual parsing: {e}")
             df = read_csv_manually(csv_path)
@@ -59,9 +61,10 @@ def send_reports(csv_path='data/patients.csv', report_folder='patient_reports',
     df['clean_name'] = df[name_column].apply(clean_name)
     df['email'] = df['clean_name'].apply(generate_email)
 
-    # Create a name-to-email map
-    email_map = {name.lower().replace(" ", "_"): email 
-                for name, email in zip(df['clean_name'], df['email'])}
+    # Map each patient's report file name to their email
+    patient_ids = df['patient_id'] if 'patient_id' in df.columns else [None] * len(df)
+    email_map = {report_filename(name, patient_id): email
+                for name, patient_id, email in zip(df['clean_name'], patient_ids, df['email'])}
 
     # Set up Yagmail if not in demo mode
     if not demo_mode:
@@ -75,42 +78,114 @@ def send_reports(csv_path='data/patients.csv', report_folder='patient_reports',
     sent_count = 0
 
     print("\nPatient email mapping:")
-    for name, email in email_map.items():
-        print(f"{name}: {email}")
+    for filename, email in email_map.items():
+        print(f"{filename}: {email}")
     print()
 
-    pdf_files = list(report_folder.glob("*.pdf"))
+    # Only per-patient reports are emailed, not batch files
+    pdf_files = list(report_folder.glob("patient_*_report.pdf"))
     if not pdf_files:
         print("No PDF reports found to send")
         return
 
+    # Optimized copies go in a subfolder so the original reports are kept as-is
+    if optimize:
+        optimized_folder = report_folder / 'optimized'
+        optimized_folder.mkdir(exist_ok=True)
+
+    bytes_before = 0
+    bytes_after = 0
+    send_seconds = 0.0
+
+    # The journal records every email so a resumed run never sends one twice
+    journal = None
+    emailed = {}
+    if journal_path:
+        journal = PipelineJournal(journal_path)
+        # Keyed on the report folder alone, so re-cleaning the CSV can never cause a resend
+        signature = f"{report_folder.resolve()}|demo={demo_mode}"
+        if journal.begin_step('email', signature, resume):
+            emailed = journal.completed('email')
+            print(f"Resuming: {sum(1 for e in emailed.values() if e['status'] == 'sent')} report(s) already sent")
+
     for report_file in pdf_files:
         try:
-            # Extract patient name slug from filename
-            filename_parts = report_file.stem.split("patient_")[1].split("_report")
-            name_slug = filename_parts[0]
-
-            if name_slug in email_map:
-                recipient = email_map[name_slug]
+            # A report that changed since it was journaled has not been sent in this form
+            report_digest = file_digest(report_file) if journal else None
+            entry = emailed.get(report_file.name, {})
+            status = entry.get('status') if entry.get('report') == report_digest else None
+            if status == 'sent':
+                continue
+            if status == 'sending':
+                # The run stopped mid-send, so the email may have gone out; check before resending by hand
+                print(f"⚠️ Skipped: {report_file.name} may already have been sent (Message-ID {entry['message_id']})")
+                continue
+
+            if report_file.name in email_map:
+                recipient = email_map[report_file.name]
                 subject = "Your Personalized Patient Health Report"
                 body = f"Hello,\n\nAttached is your health report.\n\nRegards,\nYour Clinic Team"
 
+                # Shrink the attachment before sending
+                attachment = report_file
+                original_size = optimized_size = report_file.stat().st_size
+                if optimize:
+                    try:
+                        attachment = optimized_folder / report_file.name
+                        original_size, optimized_size = optimize_pdf(report_file, attachment, target_bytes)
+                    except Exception as e:
+                        print(f"Could not optimize {report_file.name}, sending original: {e}")
+                        attachment = report_file
+                bytes_before += original_size
+                bytes_after += optimized_size
+
                 if demo_mode:
                     # For demo purposes, just show what would be sent
-                    print(f"✅ Would send: {report_file.name} to {recipient}")
+                    print(f"✅ Would send: {report_file.name} to {recipient} ({format_bytes(optimized_size)})")
+                    if journal:
+                        journal.mark('email', report_file.name, {'recipient': recipient, 'report': report_digest, 'message_id': None, 'status': 'sent'})
                     sent_count += 1
                 else:
                     # Actually send the email
-                    print(f"📧 Sending: {report_file.name} to {recipient}")
-                    yag.send(to=recipient, subject=subject, contents=body, attachments=str(report_file))
+                    print(f"📧 Sending: {report_file.name} to {recipient} ({format_bytes(optimized_size)})")
+                    message_id = make_msgid()
+                    entry = {'recipient': recipient, 'report': report_digest, 'message_id': message_id}
+                    if journal:
+                        journal.mark('email', report_file.name, dict(entry, status='sending'), durable=True)
+                    started = time.perf_counter()
+                    try:
+                        # yagmail returns False once its retries are used up
+                        sent = yag.send(to=recipient, subject=subject, contents=body, attachments=str(attachment), message_id=message_id) is not False
+                    except Exception as e:
+                        print(f"Error sending {report_file.name}: {e}")
+                        sent = False
+                    send_seconds += time.perf_counter() - started
+                    if journal:
+                        # Failed emails are retried on resume
+                        journal.mark('email', report_file.name, dict(entry, status='sent' if sent else 'failed'), durable=True)
+                    if not sent:
+                        continue
                     sent_count += 1
             else:
-                print(f"⚠️ Skipped: No email found for {name_slug}")
+                print(f"⚠️ Skipped: No email found for {report_file.name}")
         except Exception as e:
             print(f"Error processing {report_file}: {e}")
 
+    if journal:
+        journal.close()
+
     print(f"\nFinished processing {sent_count} report(s).")
 
+    if sent_count:
+        saved = bytes_before - bytes_after
+        print(f"Attachment size: {format_bytes(bytes_before)} before, {format_bytes(bytes_after)} after optimization "
+              f"({saved / bytes_before:.0%} smaller)")
+        if send_seconds > 0:
+            # Estimate the time saved from the measured upload rate
+            rate = bytes_after / send_seconds
+            print(f"Send time: {send_seconds:.1f}s at {format_bytes(rate)}/s, "
+                  f"about {saved / rate:.1f}s saved by optimization")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Send patient reports via email')
     parser.add_argument('-c', '--csv', default='data/patients.csv', help='Path to the patient CSV file')
@@ -118,12 +193,23 @@ if __name__ == "__main__":
     parser.add_argument('-e', '--email', default='your_email@gmail.com', help='Sender email address')
     parser.add_argument('-p', '--password', default='your_app_password', help='Email app password')
     parser.add_argument('-d', '--demo', action='store_true', help='Run in demo mode (no emails sent)')
+    parser.add_argument('--no-optimize', action='store_true', help='Attach reports without optimizing them')
+    parser.add_argument('--target-size', type=int, default=DEFAULT_TARGET_BYTES // 1024, help='Target attachment size in KB')
+    parser.add_argument('--journal', nargs='?', const=DEFAULT_JOURNAL, help='Record sent emails in this journal so the run can be resumed')
+    parser.add_argument('--resume', action='store_true', help='Skip reports already sent according to the journal')
     args = parser.parse_args()
+
+    if args.resume and not args.journal:
+        args.journal = DEFAULT_JOURNAL
     
     send_reports(
         csv_path=args.csv,
         report_folder=args.reports,
         sender_email=args.email,
         sender_password=args.password,
-        demo_mode=args.demo
+        demo_mode=args.demo,
+        optimize=not args.no_optimize,
+        target_bytes=args.target_size * 1024,
+        journal_path=args.journal,
+        resume=args.resume
     )
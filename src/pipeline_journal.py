@@ -0,0 +1,104 @@
+import json
+import time
+import sqlite3
+from pathlib import Path
+
+DEFAULT_JOURNAL = 'logs/pipeline_journal.db'
+
+# Progress is committed after this many records or seconds, whichever comes first
+COMMIT_EVERY = 1000
+COMMIT_SECONDS = 1.0
+
+def input_signature(input_file, **options):
+    """Describe an input file and the step options so a resume can tell if they changed"""
+    stat = Path(input_file).stat()
+    return json.dumps([str(Path(input_file).resolve()), stat.st_size, stat.st_mtime_ns, options], sort_keys=True)
+
+class PipelineJournal:
+    """SQLite journal of pipeline progress used to resume an interrupted run
+
+    Each step records the keys of the records it has finished (patient IDs,
+    report files, sent emails) and named checkpoints such as how far the
+    cleaned output has got. Writes go into an open transaction that is
+    committed every COMMIT_EVERY records or COMMIT_SECONDS, so recording a
+    record costs a single insert; pass durable=True to commit straight away
+    for work that must never be repeated. The journal runs in WAL mode
+    without an fsync per commit, which survives the process dying but not
+    the machine losing power.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL, commit_every=COMMIT_EVERY, commit_seconds=COMMIT_SECONDS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_every = commit_every
+        self.commit_seconds = commit_seconds
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS steps (step TEXT PRIMARY KEY, signature TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS checkpoints (step TEXT, name TEXT, value TEXT, PRIMARY KEY (step, name)) WITHOUT ROWID')
+        self.db.execute('CREATE TABLE IF NOT EXISTS records (step TEXT, key TEXT, detail TEXT, PRIMARY KEY (step, key)) WITHOUT ROWID')
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def begin_step(self, step, signature, resume=True):
+        """Start a step, keeping its earlier progress only when resuming with the same signature
+
+        Returns True if earlier progress was kept.
+        """
+        row = self.db.execute('SELECT signature FROM steps WHERE step = ?', (step,)).fetchone()
+        if resume and row and row[0] == signature:
+            return True
+        self.reset(step)
+        self.db.execute('INSERT OR REPLACE INTO steps VALUES (?, ?)', (step, signature))
+        self.commit()
+        return False
+
+    def reset(self, step):
+        """Forget all progress recorded for a step"""
+        for table in ('steps', 'checkpoints', 'records'):
+            self.db.execute(f'DELETE FROM {table} WHERE step = ?', (step,))
+        self.commit()
+
+    def mark(self, step, key, detail=None, durable=False):
+        """Record that a step has finished the record with this key"""
+        self.db.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?)', (step, str(key), json.dumps(detail)))
+        self._written(durable)
+
+    def completed(self, step):
+        """Return a dict of finished record keys to their details"""
+        rows = self.db.execute('SELECT key, detail FROM records WHERE step = ?', (step,))
+        return {key: json.loads(detail) for key, detail in rows}
+
+    def set_checkpoint(self, step, name, value, durable=False):
+        """Store a JSON-serializable checkpoint value"""
+        self.db.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)', (step, name, json.dumps(value)))
+        self._written(durable)
+
+    def get_checkpoint(self, step, name, default=None):
+        """Return a stored checkpoint value, or default if there is none"""
+        row = self.db.execute('SELECT value FROM checkpoints WHERE step = ? AND name = ?', (step, name)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _written(self, durable):
+        self.pending += 1
+        if durable or self.pending >= self.commit_every or time.monotonic() - self.last_commit >= self.commit_seconds:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        """Commit outstanding progress and close the database"""
+        self.commit()
+        self.db.close()
@@ -1,10 +1,24 @@
 import pandas as pd
 from fpdf import FPDF
 import os
+import sys
+import csv
+import tempfile
 import argparse
+import itertools
 from pathlib import Path
 import numpy as np
 
+# Add the current directory to the path to ensure imports work correctly
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from workspace import atomic_path
+from csv_parser import open_text_stream, parse_csv
+from pipeline_journal import PipelineJournal, input_signature, DEFAULT_JOURNAL
+
+# Rows read from the cleaned CSV at a time; peak memory depends on this, not the file size
+DEFAULT_CHUNK_SIZE = 1000
+
 # Set matplotlib to use non-interactive backend to avoid thread issues
 import matplotlib
 matplotlib.use('Agg')  # Must be set before importing pyplot
@@ -40,14 +54,63 @@ def get_doctor_recommendation(bp, hr, temp):
         elif hr < 60:
             return "Possible bradycardia, further evaluation needed."
         elif temp > 37.5:
-            return "Fever detected — consider further testing."
+            return "Fever detected, consider further testing."
         else:
             return "Vitals within normal range."
     except:
         return "Unable to analyze vitals."
 
-def create_patient_report(patient_data, output_path):
-    pdf = FPDF()
+class BookmarkedPDF(FPDF):
+    """FPDF document with a flat outline (bookmarks) pointing at pages"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outlines = []
+        self.outline_root = None
+
+    def bookmark(self, title, page=None):
+        """Add a bookmark to the current position, or to the top of the given page"""
+        if page is None:
+            self.outlines.append((title, self.page, (self.h - self.y) * self.k))
+        else:
+            self.outlines.append((title, page, self.h * self.k))
+
+    def _putbookmarks(self):
+        first = self.n + 1
+        count = len(self.outlines)
+        self.outline_root = first + count
+        for i, (title, page, y) in enumerate(self.outlines):
+            self._newobj()
+            self._out('<</Title ' + self._textstring(title))
+            self._out(f'/Parent {self.outline_root} 0 R')
+            if i > 0:
+                self._out(f'/Prev {self.n - 1} 0 R')
+            if i < count - 1:
+                self._out(f'/Next {self.n + 1} 0 R')
+            # Page objects are numbered 3, 5, 7, ... by FPDF
+            self._out(f'/Dest [{1 + 2 * page} 0 R /XYZ 0 {y:.2f} null]>>')
+            self._out('endobj')
+        self._newobj()
+        self._out(f'<</Type /Outlines /First {first} 0 R /Last {self.outline_root - 1} 0 R /Count {count}>>')
+        self._out('endobj')
+
+    def _putresources(self):
+        super()._putresources()
+        if self.outlines:
+            self._putbookmarks()
+
+    def _putcatalog(self):
+        super()._putcatalog()
+        if self.outlines:
+            self._out(f'/Outlines {self.outline_root} 0 R')
+            self._out('/PageMode /UseOutlines')
+
+def get_patient_name(patient_data, default='Unknown'):
+    """Get patient name - handle both 'name' and 'full_name' columns"""
+    return patient_data.get('full_name', patient_data.get('name', default))
+
+def render_patient_report(pdf, patient_data):
+    """Add one patient's report as new pages of an open FPDF document"""
     pdf.add_page()
 
     # Title
@@ -55,8 +118,7 @@ def create_patient_report(patient_data, output_path):
     pdf.cell(0, 10, 'Patient Health Report', ln=True, align='C')
     pdf.ln(10)
 
-    # Get patient name - handle both 'name' and 'full_name' columns
-    patient_name = patient_data.get('full_name', patient_data.get('name', 'Unknown'))
+    patient_name = get_patient_name(patient_data)
 
     # Section: Patient Info
     pdf.set_font('Arial', 'B', 14)
@@ -75,11 +137,15 @@ def create_patient_report(patient_data, output_path):
     pdf.cell(0, 10, f"Temperature: {patient_data['temperature']}°C", ln=True)
     pdf.ln(5)
 
-    # Add vitals chart
-    chart_path = 'charts/temp_chart.png'
-    os.makedirs('charts', exist_ok=True)
-    generate_chart(patient_data, chart_path)
-    pdf.image(chart_path, x=10, y=pdf.get_y(), w=100)
+    # Add vitals chart, using a unique temp file so concurrent jobs do not
+    # overwrite each other's charts and FPDF's per-name image cache is not reused
+    fd, chart_path = tempfile.mkstemp(suffix='.png')
+    os.close(fd)
+    try:
+        generate_chart(patient_data, chart_path)
+        pdf.image(chart_path, x=10, y=pdf.get_y(), w=100)
+    finally:
+        os.unlink(chart_path)
     pdf.ln(45)
 
     # Section: Diagnosis
@@ -96,46 +162,198 @@ def create_patient_report(patient_data, output_path):
     recommendation = get_doctor_recommendation(patient_data['blood_pressure'], patient_data['heart_rate'], patient_data['temperature'])
     pdf.multi_cell(0, 10, recommendation)
 
+def create_patient_report(patient_data, output_path):
+    pdf = FPDF()
+    render_patient_report(pdf, patient_data)
+
     # Save PDF
-    pdf.output(str(output_path))
+    with atomic_path(output_path) as temp_path:
+        pdf.output(temp_path)
+
+def iter_patient_records(input_file, chunksize=DEFAULT_CHUNK_SIZE):
+    """Yield each patient as a dict, reading the CSV in chunks instead of all at once"""
+    # Patient IDs stay strings so report names keep leading zeros and match email_sender
+    for chunk in pd.read_csv(input_file, chunksize=chunksize, dtype={'patient_id': str}):
+        # to_dict is much cheaper than building a Series per row with iterrows
+        yield from chunk.to_dict('records')
+
+def count_patient_records(input_file):
+    """Count data rows in a CSV with a single streaming pass"""
+    with open(input_file, 'rb') as f:
+        _, rows = parse_csv(open_text_stream(f))
+        return sum(1 for _ in rows)
+
+def report_filename(patient_name, patient_id=None):
+    """Create sanitized filename, including the patient ID so namesakes get separate reports"""
+    slug = str(patient_name).lower().replace(' ', '_')
+    if pd.notna(patient_id) and str(patient_id).strip():
+        slug += '_' + str(patient_id).strip().lower().replace(' ', '_')
+    return f"patient_{slug}_report.pdf"
 
-def main(generate_samples=True, input_file='data/patients.csv', output_folder='patient_reports'):
+def _with_last(items):
+    """Yield (item, is_last) pairs using a one-item lookahead"""
+    items = iter(items)
+    try:
+        current = next(items)
+    except StopIteration:
+        return
+    for following in items:
+        yield current, False
+        current = following
+    yield current, True
+
+def patient_key(patient_dict, index):
+    """Journal key for a patient: the patient ID, or the row number if there is none"""
+    patient_id = patient_dict.get('patient_id')
+    return str(patient_id) if pd.notna(patient_id) and str(patient_id) else f'row_{index}'
+
+def iter_patient_reports(patients, output_folder, journal=None):
+    """Write one PDF per patient, yielding each report path as soon as it is written
+
+    With a journal, each rendered patient is recorded and patients whose report
+    was already rendered are skipped without being yielded.
+    """
+    output_folder = Path(output_folder)
+    rendered = journal.completed('reports') if journal else {}
+    written = set()
+    for i, patient_dict in enumerate(patients):
+        key = patient_key(patient_dict, i) if journal else None
+        if key in rendered and (output_folder / rendered[key]).exists():
+            continue
+
+        patient_name = get_patient_name(patient_dict, f'patient_{i}')
+        output_path = output_folder / report_filename(patient_name, patient_dict.get('patient_id'))
+        if output_path.name in written:
+            # Only patients sharing both name and ID (or lacking an ID) end up here
+            print(f'Warning: row {i + 1} overwrites the report {output_path.name} of an earlier patient')
+        written.add(output_path.name)
+
+        # Generate the report
+        create_patient_report(patient_dict, output_path)
+        if journal:
+            journal.mark('reports', key, output_path.name)
+        yield output_path
+
+def iter_batch_reports(patients, output_folder, batch_size, journal=None):
+    """Write reports as multi-page PDFs of batch_size patients each
+
+    Every patient gets a bookmark, and a sidecar report_index.csv records the
+    file and first page of each patient's report. Yields once per patient:
+    the batch file path when that patient completes a batch, otherwise None.
+    With a journal, each written batch is recorded along with its index rows,
+    and the patients in batches that were already written are skipped.
+    """
+    output_folder = Path(output_folder)
+    batch_number = 0
+    pdf = None
+
+    # Batches are written in order, so resume after the leading run of finished ones
+    finished = journal.completed('reports') if journal else {}
+    finished_rows = []
+    while f'reports_batch_{batch_number + 1:04d}.pdf' in finished and (output_folder / f'reports_batch_{batch_number + 1:04d}.pdf').exists():
+        batch_number += 1
+        finished_rows.extend(finished[f'reports_batch_{batch_number:04d}.pdf'])
+    skipped = batch_number * batch_size
+
+    with atomic_path(output_folder / 'report_index.csv') as temp_index, open(temp_index, 'w', newline='') as index_file:
+        index_writer = csv.writer(index_file)
+        index_writer.writerow(['file', 'patient', 'first_page', 'page_count'])
+        index_writer.writerows(finished_rows)
+
+        for i, (patient_dict, is_last) in enumerate(_with_last(itertools.islice(patients, skipped, None)), skipped):
+            if pdf is None:
+                pdf = BookmarkedPDF()
+                batch_number += 1
+                batch_path = output_folder / f'reports_batch_{batch_number:04d}.pdf'
+                batch_rows = []
+
+            patient_name = get_patient_name(patient_dict, f'patient_{i}')
+            first_page = pdf.page + 1
+
+            render_patient_report(pdf, patient_dict)
+
+            pdf.bookmark(str(patient_name), page=first_page)
+            batch_rows.append([batch_path.name, str(patient_name), first_page, pdf.page - first_page + 1])
+            index_writer.writerow(batch_rows[-1])
+
+            # Write the batch once it is full, or after the last patient
+            if (i + 1) % batch_size == 0 or is_last:
+                # The index is only moved into place after the last batch is written
+                with atomic_path(batch_path) as temp_path:
+                    pdf.output(temp_path)
+                if journal:
+                    journal.mark('reports', batch_path.name, batch_rows)
+                pdf = None
+                yield batch_path
+            else:
+                yield None
+
+def write_batch_reports(patients, output_folder, batch_size, journal=None):
+    """Write all batch reports and return the batch file paths"""
+    batch_files = []
+    for batch_path in iter_batch_reports(patients, output_folder, batch_size, journal):
+        if batch_path:
+            print(f'Generated batch report: {batch_path}')
+            batch_files.append(batch_path)
+    return batch_files
+
+def main(generate_samples=True, input_file='data/patients.csv', output_folder='patient_reports', batch_size=None, chunksize=DEFAULT_CHUNK_SIZE, journal_path=None, resume=False):
+    """Generate reports and return the paths of the files this run wrote, or None on error"""
+    journal = None
     try:
         if generate_samples:
             df = generate_sample_data()
             data_path = Path(input_file)
             df.to_csv(data_path, index=False)
             print(f'Sample data saved to {data_path}')
+            patients = df.to_dict('records')
         else:
-            df = pd.read_csv(input_file)
-            print(f'Read {len(df)} patient records from {input_file}')
+            # Stream the records so memory use does not grow with the number of patients
+            patients = iter_patient_records(input_file, chunksize)
+            print(f'Reading patient records from {input_file}')
 
         output_folder = Path(output_folder)
         output_folder.mkdir(exist_ok=True)
 
-        for _, patient in df.iterrows():
-            # Get patient name - handle both 'name' and 'full_name' columns
-            patient_dict = patient.to_dict()
-            patient_name = patient_dict.get('full_name', patient_dict.get('name', f'patient_{_}'))
-            
-            # Create sanitized filename
-            filename = f"patient_{str(patient_name).lower().replace(' ', '_')}_report.pdf"
-            output_path = output_folder / filename
-            
-            # Generate the report
-            create_patient_report(patient_dict, output_path)
+        if journal_path:
+            journal = PipelineJournal(journal_path)
+            signature = input_signature(input_file, output_folder=str(output_folder.resolve()), batch_size=batch_size)
+            if journal.begin_step('reports', signature, resume):
+                print(f"Resuming: {len(journal.completed('reports'))} report file(s) already generated")
+
+        if batch_size:
+            batch_files = write_batch_reports(patients, output_folder, batch_size, journal)
+            print(f'\nSuccessfully generated {len(batch_files)} batch file(s) in {output_folder}/, see report_index.csv for the patients in each')
+            return batch_files
+
+        count = 0
+        report_files = []
+        for count, output_path in enumerate(iter_patient_reports(patients, output_folder, journal), 1):
             print(f'Generated report: {output_path}')
+            report_files.append(output_path)
 
-        print(f'\nSuccessfully generated {len(df)} patient reports in {output_folder}/')
+        print(f'\nSuccessfully generated {count} patient reports in {output_folder}/')
+        return report_files
 
     except Exception as e:
         print(f'Error: {e}')
+        return None
+    finally:
+        if journal:
+            journal.close()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Generate patient health reports')
     parser.add_argument('-g', '--generate', action='store_true', help='Generate sample patient data')
     parser.add_argument('-i', '--input', default='data/patients.csv', help='Input CSV file with patient data')
     parser.add_argument('-o', '--output', default='patient_reports', help='Output folder for PDF reports')
+    parser.add_argument('-b', '--batch-size', type=int, help='Combine reports into multi-page PDFs of this many patients')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Number of CSV rows to read at a time')
+    parser.add_argument('--journal', nargs='?', const=DEFAULT_JOURNAL, help='Record rendered patients in this journal so the run can be resumed')
+    parser.add_argument('--resume', action='store_true', help='Skip patients already rendered according to the journal')
     args = parser.parse_args()
     
-    main(generate_samples=args.generate, input_file=args.input, output_folder=args.output)
+    if args.resume and not args.journal:
+        args.journal = DEFAULT_JOURNAL
+    
+    main(generate_samples=args.generate, input_file=args.input, output_folder=args.output, batch_size=args.batch_size, chunksize=args.chunk_size, journal_path=args.journal, resume=args.resume)
@@ -0,0 +1,94 @@
+import os
+import sys
+from pathlib import Path
+from PIL import Image
+from pypdf import PdfWriter
+from pypdf.generic import NameObject, NumberObject, ArrayObject, ByteStringObject
+
+# Add the current directory to the path to ensure imports work correctly
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from workspace import atomic_path
+
+# Attachments larger than this are optimized more aggressively
+DEFAULT_TARGET_BYTES = 100 * 1024
+
+# (max image width in pixels, palette colors), tried in order until the target size is met
+OPTIMIZATION_LEVELS = [(None, 64), (None, 16), (300, 16), (200, 8)]
+
+def _indexed_image(image, max_width, colors):
+    """Flatten transparency onto white, downscale and reduce to a small palette"""
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    image = image.convert('RGB')
+
+    if max_width and image.width > max_width:
+        height = max(1, round(image.height * max_width / image.width))
+        image = image.resize((max_width, height), Image.LANCZOS)
+
+    return image.quantize(colors=colors)
+
+def _replace_image(image_file, image):
+    """Overwrite an image XObject in place with a Flate-compressed indexed image"""
+    # Only keep palette entries up to the highest index the image uses
+    palette = bytes(image.getpalette()[:3 * (image.getextrema()[1] + 1)])
+    obj = image_file.indirect_reference.get_object()
+    # The alpha mask and PNG predictor no longer apply to the new data
+    obj.pop(NameObject('/SMask'), None)
+    obj.pop(NameObject('/DecodeParms'), None)
+    obj[NameObject('/Width')] = NumberObject(image.width)
+    obj[NameObject('/Height')] = NumberObject(image.height)
+    obj[NameObject('/BitsPerComponent')] = NumberObject(8)
+    obj[NameObject('/ColorSpace')] = ArrayObject([
+        NameObject('/Indexed'), NameObject('/DeviceRGB'),
+        NumberObject(len(palette) // 3 - 1), ByteStringObject(palette)
+    ])
+    obj[NameObject('/Filter')] = NameObject('/FlateDecode')
+    obj.set_data(image.tobytes())
+
+def _write_optimized(input_path, output_path, max_width, colors):
+    writer = PdfWriter(clone_from=str(input_path))
+    # FPDF pages share one resource dictionary, so each image is listed on every page
+    replaced = set()
+    for page in writer.pages:
+        xobjects = page.get('/Resources', {}).get('/XObject', {})
+        for name, ref in xobjects.items():
+            # Check the reference first; decoding every listed image is slow
+            if ref.idnum in replaced or ref.get_object().get('/Subtype') != '/Image':
+                continue
+            image_file = page.images[name]
+            _replace_image(image_file, _indexed_image(image_file.image, max_width, colors))
+            replaced.add(ref.idnum)
+        page.compress_content_streams(level=9)
+    # Merge identical images and drop the replaced alpha masks
+    writer.compress_identical_objects()
+
+    with atomic_path(output_path) as temp_path:
+        writer.write(temp_path)
+    return Path(output_path).stat().st_size
+
+def optimize_pdf(input_path, output_path, target_bytes=DEFAULT_TARGET_BYTES):
+    """Write a smaller copy of a report PDF for emailing
+
+    Embedded images lose their alpha channel and are reduced to a palette,
+    content streams are recompressed and duplicate objects are merged. If
+    the result is still over target_bytes, images are downscaled further.
+    The original is copied unchanged if optimizing does not make it smaller.
+    Returns the original and final sizes in bytes.
+    """
+    original_size = Path(input_path).stat().st_size
+    optimized_size = original_size
+    for max_width, colors in OPTIMIZATION_LEVELS:
+        optimized_size = _write_optimized(input_path, output_path, max_width, colors)
+        if optimized_size <= target_bytes:
+            break
+
+    if optimized_size >= original_size:
+        with atomic_path(output_path) as temp_path:
+            Path(temp_path).write_bytes(Path(input_path).read_bytes())
+        optimized_size = original_size
+
+    return original_size, optimized_size
@@ -0,0 +1,146 @@
+import os
+import io
+import sys
+import json
+import time
+import hashlib
+from pathlib import Path
+
+# Add the current directory to the path to ensure imports work correctly
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from workspace import atomic_path
+
+# Bump to invalidate every cached result, e.g. after changing output formats
+CACHE_VERSION = '1'
+
+# Source files whose changes alter cleaned data or rendered reports
+FINGERPRINT_SOURCES = ['data_cleaner.py', 'csv_parser.py', 'report_generator.py']
+
+def code_fingerprint(extra=''):
+    """Hash the cache version, the pipeline source files and any extra settings"""
+    digest = hashlib.sha256(f"{CACHE_VERSION}|{extra}".encode())
+    src_dir = Path(__file__).resolve().parent
+    for name in FINGERPRINT_SOURCES:
+        path = src_dir / name
+        if path.exists():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class HashingReader(io.RawIOBase):
+    """Binary stream wrapper that hashes bytes as they are read
+
+    An exception raised by the wrapped stream is kept in error, so callers
+    can tell read failures apart from parse errors after the fact.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.digest = hashlib.sha256()
+        self.error = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            data = self.stream.read(len(buffer))
+        except Exception as e:
+            self.error = e
+            raise
+        self.digest.update(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file and rename it into place"""
+    with atomic_path(path) as temp_path, open(temp_path, 'w') as f:
+        json.dump(data, f)
+
+def read_json(path):
+    """Read a JSON file, returning None if it is missing or unreadable"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class ResultCache:
+    """Maps the content hash of an upload to the job that already processed it
+
+    Each entry is a small JSON file named after the hash, so entries can be
+    shared by several worker processes. Entries made with a different code
+    fingerprint are ignored and entries older than max_age seconds are
+    evicted. Evicting an entry only forgets it; the job's files are never
+    deleted by the cache, as disk space is reclaimed by job workspace cleanup.
+    """
+
+    def __init__(self, cache_dir, max_age=7 * 24 * 3600, version=None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        self.version = version or code_fingerprint()
+
+    def _entry_path(self, digest):
+        return self.cache_dir / f"{digest}.json"
+
+    def get(self, digest):
+        """Return the cached entry for an upload hash, or None if it is missing or stale"""
+        entry_path = self._entry_path(digest)
+        entry = read_json(entry_path)
+        if entry is None:
+            return None
+
+        stale = (
+            entry.get('version') != self.version
+            or time.time() - entry.get('created', 0) > self.max_age
+            or not all(Path(p).exists() for p in entry.get('required', []))
+        )
+        if stale:
+            self.evict(digest)
+            return None
+
+        return entry
+
+    def put(self, digest, job_id, required=()):
+        """Record a processed upload and evict old entries
+
+        required files must still exist for the entry to be served.
+        """
+        write_json_atomic(self._entry_path(digest), {
+            'version': self.version,
+            'job_id': job_id,
+            'created': time.time(),
+            'required': [str(p) for p in required],
+        })
+        self.prune()
+
+    def evict(self, digest):
+        """Remove an entry, leaving its artifacts in place"""
+        self._entry_path(digest).unlink(missing_ok=True)
+
+    def clear(self):
+        """Evict every entry"""
+        for entry_path in self.cache_dir.glob('*.json'):
+            self.evict(entry_path.stem)
+
+    def prune(self):
+        """Evict entries that are too old or made by other code"""
+        now = time.time()
+        for entry_path in self.cache_dir.glob('*.json'):
+            entry = read_json(entry_path)
+            if entry is None:
+                continue
+            if entry.get('version') != self.version or now - entry.get('created', 0) > self.max_age:
+                self.evict(entry_path.stem)
@@ -19,6 +19,10 @@ def run_step(command, description):
     
     return result.returncode == 0
 
+def journal_args(args):
+    """Arguments that make a step record its progress in the shared journal"""
+    return ['--journal', args.journal] + (['--resume'] if args.resume else [])
+
 def run_automation(args):
     """Run the complete patient data automation pipeline"""
     success = True
@@ -30,6 +34,9 @@ def run_automation(args):
                      '-i', args.input, 
                      '-o', args.cleaned_output, 
                      '-l', args.log]
+        if args.drop_duplicates:
+            clean_cmd.append('--drop-duplicates')
+        clean_cmd.extend(journal_args(args))
         if not run_step(clean_cmd, "Cleaning patient data"):
             print("❌ Data cleaning failed, stopping pipeline")
             return False
@@ -43,6 +50,9 @@ def run_automation(args):
         else:
             reports_cmd.extend(['-i', args.cleaned_output])
         reports_cmd.extend(['-o', args.report_folder])
+        if args.batch_size:
+            reports_cmd.extend(['-b', str(args.batch_size)])
+        reports_cmd.extend(journal_args(args))
         
         if not run_step(reports_cmd, "Generating patient reports"):
             print("❌ Report generation failed, stopping pipeline")
@@ -63,6 +73,7 @@ def run_automation(args):
         # Use demo mode by default unless explicitly set to send
         if not args.send:
             email_cmd.append('--demo')
+        email_cmd.extend(journal_args(args))
         
         if not run_step(email_cmd, "Processing emails" + (" (DEMO MODE)" if not args.send else "")):
             print("❌ Email processing failed")
@@ -99,7 +110,11 @@ if __name__ == "__main__":
     parser.add_argument('-o', '--cleaned-output', default='data/cleaned_patients.csv', help='Path to cleaned output CSV')
     parser.add_argument('-l', '--log', default='logs/data_cleaning_log.txt', help='Path to log file')
     parser.add_argument('-r', '--report-folder', default='patient_reports', help='Folder for PDF reports')
+    parser.add_argument('--drop-duplicates', action='store_true', help='Remove exact duplicate patients during cleaning')
+    parser.add_argument('-b', '--batch-size', type=int, help='Combine reports into multi-page PDFs of this many patients')
     parser.add_argument('-g', '--generate-samples', action='store_true', help='Generate sample patient data')
+    parser.add_argument('--journal', default='logs/pipeline_journal.db', help='Journal of completed work used by --resume')
+    parser.add_argument('--resume', action='store_true', help='Resume an interrupted run, skipping work recorded in the journal')
     
     # Email options
     parser.add_argument('-e', '--email-address', help='Email address for sending reports')
@@ -114,6 +129,10 @@ if __name__ == "__main__":
         args.reports = True
         args.email = True
     
+    # Batch files hold many patients, so they cannot be emailed to one recipient
+    if args.batch_size and args.email:
+        parser.error('--batch-size cannot be combined with --email or --all; run --clean --reports instead')
+    
     # If no steps specified, show help
     if not (args.clean or args.reports or args.email or args.test):
         parser.print_help()
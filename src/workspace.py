@@ -0,0 +1,103 @@
+import os
+import re
+import time
+import uuid
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# Timestamp prefix keeps job IDs sortable, the random suffix keeps them unique across workers
+JOB_ID_PATTERN = re.compile(r'^\d{8}_\d{6}_[0-9a-f]{12}$')
+
+# os.umask can only be read by setting it, so do it once at import rather than per write
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def new_job_id():
+    """Generate a job ID that is unique across processes and requests"""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:12]}"
+
+def create_job_workspace(root):
+    """Atomically create a new, empty job directory under root
+
+    Returns the job ID and the directory path. mkdir fails if the directory
+    already exists, so two jobs can never end up sharing a workspace.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    while True:
+        job_id = new_job_id()
+        job_dir = root / job_id
+        try:
+            job_dir.mkdir()
+        except FileExistsError:
+            continue
+        return job_id, job_dir
+
+def get_job_workspace(root, job_id):
+    """Return the directory of an existing job, or None for unknown or malformed IDs"""
+    if not JOB_ID_PATTERN.match(str(job_id)):
+        return None
+    job_dir = Path(root) / job_id
+    return job_dir if job_dir.is_dir() else None
+
+def touch_job_workspace(job_dir):
+    """Mark a job as recently used so workspace cleanup keeps it"""
+    os.utime(job_dir)
+
+def _last_activity(job_dir):
+    """Most recent modification time of a job directory or anything inside it"""
+    latest = job_dir.stat().st_mtime
+    for path in job_dir.rglob('*'):
+        try:
+            latest = max(latest, path.stat().st_mtime)
+        except FileNotFoundError:
+            pass
+    return latest
+
+def cleanup_job_workspaces(root, max_age):
+    """Delete job directories that have not been used for max_age seconds
+
+    A job counts as used while any file in it is being written, and when
+    touch_job_workspace is called for it, so jobs in progress are kept. The
+    newest job is always kept. Returns the IDs of the deleted jobs.
+    """
+    root = Path(root)
+    if not root.is_dir():
+        return []
+    job_dirs = sorted(p for p in root.iterdir() if p.is_dir() and JOB_ID_PATTERN.match(p.name))
+    cutoff = time.time() - max_age
+    removed = []
+    # Job IDs start with a timestamp, so the last one is the newest
+    for job_dir in job_dirs[:-1]:
+        try:
+            # Check the directory itself first to avoid walking recently used jobs
+            if job_dir.stat().st_mtime > cutoff or _last_activity(job_dir) > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(job_dir, ignore_errors=True)
+        removed.append(job_dir.name)
+    return removed
+
+@contextmanager
+def atomic_path(path):
+    """Yield a temporary path next to path and rename it into place on success
+
+    Readers either see the previous file or the complete new one, never a
+    partially written file. The temporary file is removed if writing fails.
+    The file gets the usual permissions for a new file rather than mkstemp's
+    owner-only 0600.
+    """
+    path = Path(path)
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    os.close(fd)
+    try:
+        yield temp_name
+        os.chmod(temp_name, 0o666 & ~_UMASK)
+        os.replace(temp_name, path)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
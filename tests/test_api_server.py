@@ -0,0 +1,91 @@
+import unittest
+import sys
+import os
+import io
+import gzip
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+# Add parent directory to path so we can import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the jobs and cache created on import out of the real workspace
+workspace_dir = tempfile.TemporaryDirectory()
+os.environ['WORKSPACE_ROOT'] = workspace_dir.name
+
+from src import api_server
+from src.result_cache import ResultCache
+
+CSV_DATA = b'patient_id,full_name,age,phone\nP001,john doe,45,555-123-4567\nP002,jane smith,32,555-987-6543\n'
+
+class TestUploadStream(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.temp_dir.name)
+        self.jobs_folder = root / 'jobs'
+        self.jobs_folder.mkdir()
+        cache = ResultCache(root / 'cache', version='test')
+        self.patches = [
+            patch.dict(api_server.app.config, {'JOBS_FOLDER': str(self.jobs_folder)}),
+            patch.object(api_server, 'result_cache', cache),
+        ]
+        for p in self.patches:
+            p.start()
+        self.client = api_server.app.test_client()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.temp_dir.cleanup()
+
+    def upload(self, data, filename='patients.csv', **kwargs):
+        return self.client.post('/api/upload-stream', query_string={'filename': filename}, data=data, **kwargs)
+
+    def jobs(self):
+        return list(self.jobs_folder.iterdir())
+
+    def test_plain_upload(self):
+        response = self.upload(CSV_DATA)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, response.json['records'])
+        cleaned = self.jobs_folder / response.json['job_id'] / api_server.CLEANED_FILENAME
+        self.assertIn('John Doe', cleaned.read_text())
+
+    def test_gzip_by_filename_and_content_encoding(self):
+        compressed = gzip.compress(CSV_DATA)
+        response = self.upload(compressed, filename='patients.csv.gz')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, response.json['records'])
+
+        response = self.upload(compressed, headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.json['cached'])
+
+    def test_repeated_upload_hits_cache(self):
+        first = self.upload(CSV_DATA)
+        second = self.upload(CSV_DATA)
+        self.assertEqual(200, second.status_code)
+        self.assertTrue(second.json['cached'])
+        self.assertEqual(first.json['job_id'], second.json['job_id'])
+        # The second upload's workspace is removed in favour of the cached job
+        self.assertEqual(1, len(self.jobs()))
+
+    def test_too_large(self):
+        with patch.dict(api_server.app.config, {'STREAM_MAX_CONTENT_LENGTH': 16}):
+            response = self.upload(CSV_DATA)
+            self.assertEqual(413, response.status_code)
+
+            # Without a Content-Length the limit is enforced while reading
+            response = self.upload(io.BytesIO(CSV_DATA), environ_overrides={'wsgi.input_terminated': True})
+            self.assertEqual(413, response.status_code)
+        self.assertEqual([], self.jobs())
+
+    def test_client_disconnected(self):
+        response = self.upload(CSV_DATA, environ_overrides={'CONTENT_LENGTH': str(len(CSV_DATA) + 100)})
+        self.assertEqual(400, response.status_code)
+        self.assertEqual([], self.jobs())
+
+if __name__ == '__main__':
+    unittest.main()
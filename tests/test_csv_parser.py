@@ -0,0 +1,52 @@
+import unittest
+import sys
+import os
+import io
+import gzip
+
+# Add parent directory to path so we can import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.csv_parser import fit_row, parse_csv, open_text_stream
+
+class TestCsvParser(unittest.TestCase):
+
+    def test_fit_row(self):
+        self.assertEqual(['a', 'b', ''], fit_row(['a', 'b'], 3))
+        self.assertEqual(['a', 'b', 'c d'], fit_row(['a', 'b', 'c', 'd'], 3))
+        self.assertEqual(['a', 'b', 'c'], fit_row(['a', 'b', 'c'], 3))
+
+    def test_parse_csv_quoted_newlines(self):
+        text = io.StringIO(
+            'patient_id, full_name ,vitals_notes\n'
+            'P001,John Doe,"BP: 120/80\nHR: 72"\n'
+            '\n'
+            'P002,Jane Smith\n'
+        )
+        headers, rows = parse_csv(text)
+        rows = list(rows)
+
+        self.assertEqual(['patient_id', 'full_name', 'vitals_notes'], headers)
+        self.assertEqual(2, len(rows))
+        self.assertEqual('BP: 120/80\nHR: 72', rows[0][2])
+        self.assertEqual(['P002', 'Jane Smith', ''], rows[1])
+
+    def test_parse_csv_empty(self):
+        with self.assertRaises(ValueError):
+            parse_csv(io.StringIO(''))
+
+    def test_open_text_stream_gzip(self):
+        raw = '\ufeffpatient_id,full_name\nP001,John Doe\n'.encode()
+        for data in (raw, gzip.compress(raw)):
+            headers, rows = parse_csv(open_text_stream(io.BytesIO(data)))
+            self.assertEqual(['patient_id', 'full_name'], headers)
+            self.assertEqual([['P001', 'John Doe']], list(rows))
+
+    def test_open_text_stream_rejects_invalid_encoding(self):
+        raw = 'patient_id,full_name\nP001,José Díaz\n'.encode('latin-1')
+        with self.assertRaises(UnicodeDecodeError):
+            headers, rows = parse_csv(open_text_stream(io.BytesIO(raw)))
+            list(rows)
+
+if __name__ == '__main__':
+    unittest.main()
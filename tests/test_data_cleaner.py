@@ -1,12 +1,16 @@
 import unittest
 import sys
 import os
+import io
+import gzip
+import tempfile
+import pandas as pd
 from pathlib import Path
 
 # Add parent directory to path so we can import from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.data_cleaner import clean_name, clean_phone, clean_csv
+from src.data_cleaner import clean_name, clean_phone, clean_csv, clean_csv_stream, normalize_identity, PatientIndex
 
 class TestDataCleaner(unittest.TestCase):
     
@@ -51,5 +55,100 @@ class TestDataCleaner(unittest.TestCase):
         test_log.unlink(missing_ok=True)
         test_dir.rmdir()
 
+    def test_clean_csv_stream(self):
+        raw = (
+            'patient_id,full_name,date_of_birth,age,phone,vitals_notes\n'
+            'P001,john DOE,1980-01-15,43,555-123-4567,"BP: 120/80, HR: 72"\n'
+            'P002,JANE smith,1975-05-20,48,(555) 987-6543,"BP: 130/85, HR: 75"\n'
+        ).encode()
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            plain_output = Path(temp_dir) / 'plain.csv'
+            gzip_output = Path(temp_dir) / 'gzip.csv'
+            log = Path(temp_dir) / 'log.txt'
+            
+            # Plain and gzip-compressed uploads should produce identical output
+            self.assertEqual(2, clean_csv_stream(io.BytesIO(raw), plain_output, log))
+            self.assertEqual(2, clean_csv_stream(io.BytesIO(gzip.compress(raw)), gzip_output, log))
+            self.assertEqual(plain_output.read_text(), gzip_output.read_text())
+            
+            lines = plain_output.read_text().split('\n')
+            self.assertEqual('P001,John Doe,1980-01-15,43,"5551234567","BP: 120/80, HR: 72"', lines[1])
+
+    def test_clean_csv_quotes_in_fields(self):
+        raw = (
+            'patient_id,full_name,age,phone,vitals_notes\n'
+            'P001,john doe,43,555-123-4567,"BP ""high"", HR 72"\n'
+            'P002,jane smith,48,555-987-6543,"said ""fine"""\n'
+        )
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = Path(temp_dir) / 'input.csv'
+            output_file = Path(temp_dir) / 'output.csv'
+            input_file.write_text(raw)
+
+            self.assertTrue(clean_csv(input_file, output_file, Path(temp_dir) / 'log.txt'))
+            df = pd.read_csv(output_file, dtype=str)
+            self.assertEqual(['BP "high", HR 72', 'said "fine"'], list(df['vitals_notes']))
+            self.assertEqual(['5551234567', '5559876543'], list(df['phone']))
+
+    def test_normalize_identity(self):
+        self.assertEqual(
+            normalize_identity('John Doe', '555-123-4567', '43'),
+            normalize_identity('DOE, john', '+1 (555) 123-4567', '43.0')
+        )
+        self.assertNotEqual(
+            normalize_identity('John Doe', '555-123-4567', '43'),
+            normalize_identity('John Doe', '555-123-4567', '44')
+        )
+        self.assertIsNone(normalize_identity('', '', '43'))
+        # A name and age alone do not identify a patient
+        self.assertIsNone(normalize_identity('Ann Lee', '', '40'))
+        self.assertNotEqual(
+            normalize_identity('Ann Lee', '', '40', patient_id='P1'),
+            normalize_identity('ann lee', '', '40', patient_id='P2')
+        )
+        self.assertEqual(
+            normalize_identity('Ann Lee', '', '40', date_of_birth='1984-02-01', patient_id='P1'),
+            normalize_identity('ann lee', '', '40', date_of_birth='1984-02-01', patient_id='P2')
+        )
+    
+    def test_clean_csv_stream_duplicates(self):
+        raw = (
+            'patient_id,full_name,age,phone,diagnosis\n'
+            'P001,john DOE,43,555-123-4567,Asthma\n'
+            'P001,John Doe,43,(555) 123-4567,Asthma\n'
+            'P002,Doe John,43,555.123.4567,Asthma\n'
+            'P003,Jane Smith,48,555-987-6543,Diabetes\n'
+        ).encode()
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output = Path(temp_dir) / 'out.csv'
+            log = Path(temp_dir) / 'log.txt'
+            
+            # Duplicates are only reported by default
+            index = PatientIndex()
+            self.assertEqual(4, clean_csv_stream(io.BytesIO(raw), output, log, index=index))
+            self.assertEqual(1, index.exact_count)
+            self.assertEqual(1, index.near_count)
+            self.assertIn('Line 3 is a duplicate of line 1 (near match)', log.read_text())
+            
+            # Only exact duplicates are removed when requested
+            self.assertEqual(3, clean_csv_stream(io.BytesIO(raw), output, log, drop_duplicates=True))
+            self.assertEqual(['P001', 'P002', 'P003'], [line.split(',')[0] for line in output.read_text().split('\n')[1:]])
+    
+    def test_different_patients_without_phone_are_kept(self):
+        raw = (
+            'patient_id,full_name,age,phone,blood_pressure,diagnosis\n'
+            'P1,ann lee,40,,120/80,Asthma\n'
+            'P2,Ann Lee,40,,150/95,Diabetes\n'
+        ).encode()
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output = Path(temp_dir) / 'out.csv'
+            index = PatientIndex()
+            self.assertEqual(2, clean_csv_stream(io.BytesIO(raw), output, Path(temp_dir) / 'log.txt', drop_duplicates=True, index=index))
+            self.assertEqual(0, index.exact_count + index.near_count)
+
 if __name__ == '__main__':
     unittest.main()
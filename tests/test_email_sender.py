@@ -7,7 +7,10 @@ from pathlib import Path
 # Add parent directory to path so we can import from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.email_sender import generate_email, clean_name, read_csv_manually
+import io
+from contextlib import redirect_stdout
+
+from src.email_sender import generate_email, clean_name, read_csv_manually, send_reports
 
 class TestEmailSender(unittest.TestCase):
     
@@ -43,5 +46,46 @@ class TestEmailSender(unittest.TestCase):
             # Cleanup
             os.unlink(temp_path)
 
+    def test_resume_resends_changed_reports(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            csv_path = root / 'patients.csv'
+            csv_path.write_text('full_name\nJohn Doe\nJane Smith\n')
+            reports = root / 'reports'
+            reports.mkdir()
+            (reports / 'patient_john_doe_report.pdf').write_bytes(b'john v1')
+            (reports / 'patient_jane_smith_report.pdf').write_bytes(b'jane v1')
+            journal = root / 'journal.db'
+
+            def run():
+                output = io.StringIO()
+                with redirect_stdout(output):
+                    send_reports(csv_path, reports, demo_mode=True, optimize=False, journal_path=journal, resume=True)
+                return output.getvalue()
+
+            self.assertEqual(2, run().count('Would send'))
+            self.assertEqual(0, run().count('Would send'))
+
+            # A report rendered again from new data must be sent again
+            (reports / 'patient_john_doe_report.pdf').write_bytes(b'john v2')
+            output = run()
+            self.assertEqual(1, output.count('Would send'))
+            self.assertIn('patient_john_doe_report.pdf', output)
+
+    def test_reports_are_matched_by_patient_id(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            csv_path = root / 'patients.csv'
+            csv_path.write_text('patient_id,full_name\n001,John Doe\n002,John Doe\n')
+            reports = root / 'reports'
+            reports.mkdir()
+            (reports / 'patient_john_doe_001_report.pdf').write_bytes(b'first')
+            (reports / 'patient_john_doe_002_report.pdf').write_bytes(b'second')
+
+            output = io.StringIO()
+            with redirect_stdout(output):
+                send_reports(csv_path, reports, demo_mode=True, optimize=False)
+            self.assertEqual(2, output.getvalue().count('Would send'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+# Add parent directory to path so we can import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.pipeline_journal import PipelineJournal, input_signature
+from src.data_cleaner import clean_csv_resumable, clean_row
+from src.report_generator import generate_sample_data, iter_patient_reports
+
+class TestPipelineJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.journal_path = self.root / 'journal.db'
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_input(self, rows=25):
+        input_file = self.root / 'patients.csv'
+        lines = ['patient_id,full_name,age,phone']
+        lines += [f'P{i:03d},patient {i},{30 + i},555-000-{i:04d}' for i in range(rows)]
+        # A duplicate of the first patient after the first checkpoint
+        lines.append('P999,Patient 0,30,555-000-0000')
+        input_file.write_text('\n'.join(lines) + '\n')
+        return input_file
+
+    def test_records_and_checkpoints(self):
+        with PipelineJournal(self.journal_path, commit_every=2) as journal:
+            self.assertFalse(journal.begin_step('reports', 'sig1'))
+            journal.mark('reports', 'P001', 'a.pdf')
+            journal.set_checkpoint('reports', 'progress', {'rows': 1})
+
+        # Progress survives reopening, but only while resuming with the same signature
+        with PipelineJournal(self.journal_path) as journal:
+            self.assertTrue(journal.begin_step('reports', 'sig1'))
+            self.assertEqual({'P001': 'a.pdf'}, journal.completed('reports'))
+            self.assertEqual({'rows': 1}, journal.get_checkpoint('reports', 'progress'))
+
+            self.assertFalse(journal.begin_step('reports', 'sig2'))
+            self.assertEqual({}, journal.completed('reports'))
+
+    def test_clean_resume_from_checkpoint(self):
+        input_file = self.write_input()
+        output_file = self.root / 'cleaned.csv'
+        log_file = self.root / 'clean.log'
+
+        with PipelineJournal(self.journal_path) as journal:
+            expected = clean_csv_resumable(input_file, output_file, log_file, journal, resume=False, drop_duplicates=True, checkpoint_rows=10)
+        expected_output = output_file.read_text()
+
+        # Interrupt a fresh run partway through, after the second checkpoint
+        calls = []
+        def interrupted_clean_row(row, headers):
+            calls.append(row)
+            if len(calls) == 25:
+                raise KeyboardInterrupt
+            return clean_row(row, headers)
+
+        output_file.unlink()
+        with self.assertRaises(KeyboardInterrupt):
+            with PipelineJournal(self.journal_path) as journal, patch('src.data_cleaner.clean_row', interrupted_clean_row):
+                clean_csv_resumable(input_file, output_file, log_file, journal, resume=False, drop_duplicates=True, checkpoint_rows=10)
+        partial = Path(f'{output_file}.partial')
+        self.assertTrue(partial.exists())
+        self.assertFalse(output_file.exists())
+
+        with PipelineJournal(self.journal_path) as journal:
+            count = clean_csv_resumable(input_file, output_file, log_file, journal, resume=True, drop_duplicates=True, checkpoint_rows=10)
+
+        self.assertEqual(expected, count)
+        self.assertEqual(expected_output, output_file.read_text())
+        self.assertFalse(partial.exists())
+        # The duplicate is still found although its first occurrence was before the checkpoint
+        self.assertIn('Line 26 is a duplicate of line 1', log_file.read_text())
+
+    def test_reports_skip_rendered_patients(self):
+        df = generate_sample_data()
+        df['patient_id'] = [f'P{i}' for i in range(len(df))]
+        patients = df.to_dict('records')
+
+        with PipelineJournal(self.journal_path) as journal:
+            journal.begin_step('reports', 'sig')
+            first = list(iter_patient_reports(patients[:2], self.root, journal))
+
+        with PipelineJournal(self.journal_path) as journal:
+            journal.begin_step('reports', 'sig')
+            rest = list(iter_patient_reports(patients, self.root, journal))
+            self.assertEqual(5, len(journal.completed('reports')))
+
+        self.assertEqual(2, len(first))
+        self.assertEqual(3, len(rest))
+        self.assertNotIn(first[0], rest)
+
+    def test_input_signature_changes_with_file(self):
+        input_file = self.write_input()
+        signature = input_signature(input_file, batch_size=None)
+        self.assertNotEqual(signature, input_signature(input_file, batch_size=10))
+        input_file.write_text('patient_id\nP1\n')
+        self.assertNotEqual(signature, input_signature(input_file, batch_size=None))
+
+if __name__ == '__main__':
+    unittest.main()
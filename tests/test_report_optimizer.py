@@ -0,0 +1,48 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from pypdf import PdfReader
+
+# Add parent directory to path so we can import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.report_generator import generate_sample_data, create_patient_report
+from src.report_optimizer import optimize_pdf
+
+class TestReportOptimizer(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        patient = generate_sample_data().iloc[0].to_dict()
+        self.report = self.root / 'report.pdf'
+        create_patient_report(patient, self.report)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_optimize_pdf(self):
+        optimized = self.root / 'optimized.pdf'
+        original_size, optimized_size = optimize_pdf(self.report, optimized)
+
+        self.assertEqual(self.report.stat().st_size, original_size)
+        self.assertEqual(optimized.stat().st_size, optimized_size)
+        self.assertLess(optimized_size, original_size)
+
+        reader = PdfReader(optimized)
+        self.assertEqual(1, len(reader.pages))
+        self.assertIn('Patient Health Report', reader.pages[0].extract_text())
+
+    def test_smaller_target_downscales_images(self):
+        default = self.root / 'default.pdf'
+        small = self.root / 'small.pdf'
+        _, default_size = optimize_pdf(self.report, default)
+        _, small_size = optimize_pdf(self.report, small, target_bytes=1)
+
+        self.assertLess(small_size, default_size)
+        self.assertEqual(1, len(PdfReader(small).pages))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
 import unittest
-from src.report_generator import get_doctor_recommendation, generate_sample_data
+from src.report_generator import get_doctor_recommendation, generate_sample_data, create_patient_report, write_batch_reports, iter_batch_reports, iter_patient_reports, iter_patient_records, count_patient_records
 import os
+import csv
+import tempfile
+from pathlib import Path
 
 class TestPatientReportUtils(unittest.TestCase):
 
@@ -16,6 +19,29 @@ class TestPatientReportUtils(unittest.TestCase):
         rec = get_doctor_recommendation("120/80", 70, 38.0)
         self.assertIn("fever", rec.lower())
 
+    def test_recommendations_render_in_pdf(self):
+        # Core PDF fonts are latin-1 only, so every recommendation must encode
+        for rec in [get_doctor_recommendation(bp, hr, temp) for bp, hr, temp in
+                    [("150/90", 80, 37.0), ("120/80", 55, 36.8), ("120/80", 70, 38.0), ("120/80", 72, 36.9), ("", 72, 36.9)]]:
+            rec.encode('latin-1')
+
+        patient = generate_sample_data().iloc[0].to_dict()
+        patient.update(blood_pressure='120/80', heart_rate=72, temperature=38.5)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir) / 'fever.pdf'
+            create_patient_report(patient, output_path)
+            self.assertTrue(output_path.exists())
+
+    def test_namesakes_get_separate_reports(self):
+        patients = generate_sample_data().iloc[:2].to_dict('records')
+        patients[1]['name'] = patients[0]['name']
+        patients[0]['patient_id'], patients[1]['patient_id'] = 'P001', 'P002'
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = list(iter_patient_reports(patients, temp_dir))
+            self.assertEqual(2, len({path.name for path in paths}))
+            self.assertTrue(paths[0].name.endswith('_p001_report.pdf'))
+            self.assertTrue(all(path.exists() for path in paths))
+
     def test_normal_vitals(self):
         rec = get_doctor_recommendation("120/80", 72, 36.9)
         self.assertIn("normal", rec.lower())
@@ -26,5 +52,44 @@ class TestPatientReportUtils(unittest.TestCase):
         self.assertIn("name", df.columns)
         self.assertIn("age", df.columns)
 
+    def test_write_batch_reports(self):
+        df = generate_sample_data()
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                batch_files = write_batch_reports(df.to_dict('records'), Path(temp_dir), batch_size=2)
+                self.assertEqual(['reports_batch_0001.pdf', 'reports_batch_0002.pdf', 'reports_batch_0003.pdf'],
+                                 [f.name for f in batch_files])
+                self.assertTrue(all(f.exists() for f in batch_files))
+
+                with open(Path(temp_dir) / 'report_index.csv') as f:
+                    index = list(csv.DictReader(f))
+                self.assertEqual(5, len(index))
+                self.assertEqual(('reports_batch_0001.pdf', '2'), (index[1]['file'], index[1]['first_page']))
+                self.assertEqual(('reports_batch_0003.pdf', '1'), (index[4]['file'], index[4]['first_page']))
+            finally:
+                os.chdir(cwd)
+
+    def test_iter_batch_reports_progress(self):
+        df = generate_sample_data()
+        df['temperature'] = 36.6
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # One result per patient, with the batch file once it is complete
+            results = list(iter_batch_reports(df.to_dict('records'), Path(temp_dir), batch_size=2))
+            self.assertEqual([None, 'reports_batch_0001.pdf', None, 'reports_batch_0002.pdf', 'reports_batch_0003.pdf'],
+                             [path.name if path else None for path in results])
+
+    def test_iter_patient_records(self):
+        df = generate_sample_data()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            csv_path = Path(temp_dir) / 'patients.csv'
+            df.to_csv(csv_path, index=False)
+
+            # Small chunks must still yield every record in order
+            records = list(iter_patient_records(csv_path, chunksize=2))
+            self.assertEqual(list(df['name']), [record['name'] for record in records])
+            self.assertEqual(5, count_patient_records(csv_path))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import sys
+import os
+import io
+import hashlib
+import tempfile
+from pathlib import Path
+
+# Add parent directory to path so we can import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.result_cache import ResultCache, HashingReader, file_digest
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_artifact(self, name, size=10):
+        path = self.root / name
+        path.write_bytes(b'x' * size)
+        return path
+
+    def test_hashing(self):
+        data = b'patient_id,full_name\nP001,John Doe\n'
+        reader = io.BufferedReader(HashingReader(io.BytesIO(data)))
+        self.assertEqual(data, reader.read())
+        self.assertEqual(hashlib.sha256(data).hexdigest(), reader.raw.hexdigest())
+
+        path = self.make_artifact('input.csv')
+        self.assertEqual(hashlib.sha256(path.read_bytes()).hexdigest(), file_digest(path))
+
+    def test_hashing_reader_keeps_read_errors(self):
+        class FailingStream:
+            def read(self, size):
+                raise OSError('connection reset')
+
+        reader = HashingReader(FailingStream())
+        with self.assertRaises(OSError):
+            reader.read(10)
+        self.assertIsInstance(reader.error, OSError)
+
+    def test_get_and_put(self):
+        cache = ResultCache(self.root / 'cache', version='v1')
+        cleaned = self.make_artifact('cleaned.csv')
+
+        self.assertIsNone(cache.get('abc'))
+        cache.put('abc', 'job1', required=[cleaned])
+        self.assertEqual('job1', cache.get('abc')['job_id'])
+
+        # A missing required artifact makes the entry stale
+        cleaned.unlink()
+        self.assertIsNone(cache.get('abc'))
+
+    def test_version_change_invalidates(self):
+        cleaned = self.make_artifact('cleaned.csv')
+        ResultCache(self.root / 'cache', version='v1').put('abc', 'job1', required=[cleaned])
+
+        self.assertIsNone(ResultCache(self.root / 'cache', version='v2').get('abc'))
+        # The job's files are left for workspace cleanup to remove
+        self.assertTrue(cleaned.exists())
+
+    def test_eviction(self):
+        cache = ResultCache(self.root / 'cache', version='v1')
+        first = self.make_artifact('first.csv')
+        cache.put('first', 'job1', required=[first])
+        self.assertIsNotNone(cache.get('first'))
+
+        # Expired entries are forgotten when the next result is stored
+        cache.max_age = -1
+        cache.put('second', 'job2')
+        self.assertEqual([], list((self.root / 'cache').glob('*.json')))
+        self.assertTrue(first.exists())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import sys
+import os
+import time
+import tempfile
+from pathlib import Path
+
+# Add parent directory to path so we can import from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.workspace import new_job_id, create_job_workspace, get_job_workspace, atomic_path, cleanup_job_workspaces, touch_job_workspace
+
+class TestWorkspace(unittest.TestCase):
+
+    def test_job_ids_are_unique(self):
+        ids = {new_job_id() for _ in range(1000)}
+        self.assertEqual(1000, len(ids))
+
+    def test_create_and_get_job_workspace(self):
+        with tempfile.TemporaryDirectory() as root:
+            job_id, job_dir = create_job_workspace(root)
+            self.assertTrue(job_dir.is_dir())
+            self.assertEqual(job_dir, get_job_workspace(root, job_id))
+
+            self.assertIsNone(get_job_workspace(root, '../etc'))
+            self.assertIsNone(get_job_workspace(root, new_job_id()))
+
+    def test_atomic_path(self):
+        with tempfile.TemporaryDirectory() as root:
+            target = Path(root) / 'cleaned.csv'
+            target.write_text('old')
+
+            with self.assertRaises(RuntimeError):
+                with atomic_path(target) as temp_path:
+                    Path(temp_path).write_text('partial')
+                    raise RuntimeError('write failed')
+
+            # A failed write leaves the old file and no temp files behind
+            self.assertEqual('old', target.read_text())
+            self.assertEqual(['cleaned.csv'], os.listdir(root))
+
+            with atomic_path(target) as temp_path:
+                Path(temp_path).write_text('new')
+            self.assertEqual('new', target.read_text())
+
+            # Permissions match a file created with open(), not mkstemp's 0600
+            plain = Path(root) / 'plain.csv'
+            plain.write_text('new')
+            self.assertEqual(plain.stat().st_mode, target.stat().st_mode)
+
+    def test_cleanup_job_workspaces(self):
+        with tempfile.TemporaryDirectory() as root:
+            old_time = time.time() - 3600
+            jobs = {}
+            for name in ('20240101_000000_aaaaaaaaaaaa', '20240101_000000_bbbbbbbbbbbb',
+                         '20240101_000000_cccccccccccc', '20240101_000000_dddddddddddd'):
+                job_dir = Path(root) / name
+                (job_dir / 'reports').mkdir(parents=True)
+                (job_dir / 'cleaned.csv').write_text('x')
+                for path in (job_dir / 'cleaned.csv', job_dir / 'reports', job_dir):
+                    os.utime(path, (old_time, old_time))
+                jobs[name] = job_dir
+
+            # A job still writing reports, and one that was just reused
+            (jobs['20240101_000000_bbbbbbbbbbbb'] / 'reports' / 'report.pdf').write_text('x')
+            touch_job_workspace(jobs['20240101_000000_cccccccccccc'])
+
+            removed = cleanup_job_workspaces(root, max_age=60)
+
+            self.assertEqual(['20240101_000000_aaaaaaaaaaaa'], removed)
+            self.assertFalse(jobs['20240101_000000_aaaaaaaaaaaa'].exists())
+            # The newest job is kept however old it is
+            self.assertTrue(jobs['20240101_000000_dddddddddddd'].exists())
+
+if __name__ == '__main__':
+    unittest.main()